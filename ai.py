@@ -1,44 +1,52 @@
 import os
+import re
 import json
 import time
+import asyncio
+import fastmath
+import tracing
 from dotenv import load_dotenv
-from collections import defaultdict, deque
-import google.generativeai as genai
+from gemini import generate, stream, dispatcher
+from dispatcher import SlowDown
+from cache import ResponseCache
+from memory import ConversationStore, write_atomic
+from prompt import PromptBuilder
+from status import bot_status
 
 load_dotenv()
 
-STATUS_FILE = "bot_status.json"
 OWNER_ID = os.getenv("OWNER_ID")
+SYSTEM_USER_ID = "000000000000000000"  # prompts from scheduled jobs, not a Discord user
 
-# Per-user conversation history: {user_id: deque(maxlen=5)}
-# We'll only store USER prompts, not all messages
-user_histories = defaultdict(lambda: deque(maxlen=10))
-last_bot_reply = {}  # store last Mathy reply per user
+# Per-user conversation memory: the last 10 USER prompts plus Mathy's last reply.
+# Bounded (LRU + idle TTL + size cap) and snapshotted to disk across restarts.
+CONVERSATION_SNAPSHOT = os.getenv("CONVERSATION_SNAPSHOT", "conversations.json")
+conversations = ConversationStore(
+    history_len=10,
+    max_users=int(os.getenv("CONVERSATION_MAX_USERS", "5000")),
+    max_chars=int(os.getenv("CONVERSATION_MAX_CHARS", "8000000")),
+    idle_ttl=float(os.getenv("CONVERSATION_IDLE_TTL", str(7 * 24 * 3600))),
+)
+conversations.restore(CONVERSATION_SNAPSHOT)
 
-def mark_error_in_status_file():
-    """Marks an error flag in bot_status.json."""
-    status = {}
-    try:
-        if os.path.exists(STATUS_FILE):
-            with open(STATUS_FILE, "r") as f:
-                status = json.load(f)
-    except Exception as e:
-        print(f"Error reading status file for marking error: {e}")
-
-    status["error"] = True
-    status["timestamp"] = time.time()
-    try:
-        with open(STATUS_FILE, "w") as f:
-            json.dump(status, f)
-        print("Marked error = True in bot_status.json")
-    except Exception as e:
-        print(f"Error writing error flag to status file: {e}")
+# Replies to repeated prompts ("ping", the same pasted homework question, ...)
+response_cache = ResponseCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "900")),
+)
+# Prompts that lean on the conversation so far; their replies depend on the asker and aren't shared
+FOLLOW_UP = re.compile(
+    r"\b(again|above|previous(ly)?|earlier|continue|go on|you (said|meant|wrote)|your (answer|reply)"
+    r"|last (one|answer|reply|question)|(this|that|the same|next) (one|question|step|part)"
+    r"|more detail|explain more|wdym|what do you mean)\b"
+    r"|^\W*(why|how|huh|and|so|but|explain)\W*$",
+    re.IGNORECASE,
+)
+MENTION = re.compile(r"<@[!&]?\d+>")
 
-# Configure the Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Choose the Gemini model
-model = genai.GenerativeModel("gemini-2.5-flash")
+def mark_error_in_status_file():
+    """Raises the error flag on the status LEDs."""
+    bot_status.set_error(True)
 
 # === Core Prompt Template ===
 BASE_PROMPT = """You are Mathy — a chaotic, meme-fueled Gen Z math tutor with cracked math skills and unhinged TikTok energy.  
@@ -83,43 +91,183 @@ User: {user_ident} (ID: {user_id}) says:
 {user_prompt}
 """
 
+# Static part of BASE_PROMPT is formatted once; history/last reply are fitted to PROMPT_TOKEN_BUDGET
+prompt_builder = PromptBuilder(BASE_PROMPT, OWNER_ID, conversations)
+
 def add_user_prompt(user_id: str, username: str, prompt: str):
     """Adds the user's prompt and username to history."""
-    user_histories[user_id].append((username, prompt))
+    conversations.add_prompt(user_id, username, prompt)
 
 def get_conversation_history(user_id: str):
     """Returns recent user prompts with usernames."""
-    return "\n".join([f"{username}: {prompt}" for username, prompt in user_histories[user_id]])
+    return "\n".join([f"{username}: {prompt}" for username, prompt in conversations.history(user_id)])
+
+async def save_conversations():
+    """Snapshots conversation memory to CONVERSATION_SNAPSHOT without blocking on disk."""
+    payload = json.dumps(conversations.to_dict())  # serialize on the loop, where the store is mutated
+    await asyncio.to_thread(write_atomic, CONVERSATION_SNAPSHOT, payload)
+
+def build_prompt(user_prompt: str, user_ident: str, user_id: str):
+    """Fills BASE_PROMPT with the user's recent history and Mathy's last reply, within the token budget."""
+    return prompt_builder.build(user_prompt, user_ident, user_id)
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", prompt).strip().lower().rstrip("?!. ")
+
+def is_cacheable(user_prompt: str) -> bool:
+    # The presence quote should be fresh every time
+    return not user_prompt.startswith("Fill in the blanks")
+
+def shared_prompt(user_prompt: str) -> str:
+    """The prompt without mentions, which is what a shared reply answers."""
+    return MENTION.sub("", user_prompt).strip()
+
+def is_shareable(user_prompt: str) -> bool:
+    """Whether the reply can be cached and shared: the prompt stands on its own, without earlier turns."""
+    return is_cacheable(user_prompt) and bool(shared_prompt(user_prompt)) and not FOLLOW_UP.search(user_prompt)
+
+def cache_key(user_prompt: str):
+    """Keys a shared reply on the normalized, mention-free prompt; the same for every user."""
+    return normalize_prompt(shared_prompt(user_prompt))
+
+def model_user(user_id: str):
+    """The user a model call is queued and rate limited as (None for system jobs)."""
+    return None if user_id == SYSTEM_USER_ID else user_id
+
+def slow_down_reply(e: SlowDown) -> str:
+    if e.reason == "rate":
+        return f"🐢 Slow down, speedrunner! My brain needs {max(1, round(e.retry_after))}s to cool off before your next one 🧊"
+    return "🚦 Mathy is swamped with questions rn, try again in a bit 😵‍💫"
+
+async def generate_reply(full_prompt: str, user_id: str = SYSTEM_USER_ID) -> str:
+    """Asks Gemini for a reply and redacts the owner ID from it."""
+    response_text = await generate(full_prompt, user_id=model_user(user_id))
+    return response_text.replace(OWNER_ID, "`redacted`")
 
 # === Generate response using prompt ===
-async def get_mathy_response(user_prompt: str, user_ident: str = "Unknown User", user_id: str = "000000000000000000"):
+async def get_mathy_response(user_prompt: str, user_ident: str = "Unknown User", user_id: str = SYSTEM_USER_ID):
     try:
+        # Plain arithmetic / calculus is answered locally, no Gemini call
+        with tracing.span("fastpath"):
+            answer = await fastmath.try_answer(user_prompt) if is_cacheable(user_prompt) else None
+        if answer is not None:
+            tracing.tag(path="fastpath")
+            add_user_prompt(user_id, user_ident, user_prompt)
+            conversations.set_last_reply(user_id, answer)
+            return answer
+
+        # Users over their model budget get a canned reply (and the prompt isn't remembered);
+        # cached and in-flight replies are free, only a new model call spends a token
+        shareable = is_shareable(user_prompt)
+        if model_user(user_id) and not (shareable and response_cache.has(cache_key(user_prompt))):
+            dispatcher.check(user_id)
+
         # Add user prompt to history
         add_user_prompt(user_id, user_ident, user_prompt)
 
-        # Build conversation history
-        history_text = get_conversation_history(user_id)
-        last_reply = last_bot_reply.get(user_id, "(No previous reply)")
-
-        # Build full prompt
-        full_prompt = BASE_PROMPT.format(
-            owner_id=OWNER_ID,
-            conversation_history=history_text,
-            last_reply=last_reply,
-            user_ident=user_ident,
-            user_id=user_id,
-            user_prompt=user_prompt
-        )
-
-        # Get response from Gemini
-        response_obj = model.generate_content(full_prompt)
-        response_text = response_obj.text.replace(OWNER_ID, "`redacted`")
-        print(full_prompt)
+        # Build full prompt: a self-contained prompt gets a user-neutral one, so its reply can be shared
+        with tracing.span("prompt"):
+            if shareable:
+                full_prompt = prompt_builder.build_shared(shared_prompt(user_prompt))
+            else:
+                full_prompt = build_prompt(user_prompt, user_ident, user_id)
+
+        # Get response from the cache or Gemini (identical concurrent prompts share one call)
+        tracing.tag(path="model")
+        with tracing.span("model"):
+            if shareable:
+                response_text = await response_cache.get_or_fetch(
+                    cache_key(user_prompt), lambda: generate_reply(full_prompt, user_id)
+                )
+            else:
+                response_text = await generate_reply(full_prompt, user_id)
         # Store this as the last reply for context next time
-        if not user_prompt.startswith("Fill in the blanks"):
-            last_bot_reply[user_id] = response_text
+        if is_cacheable(user_prompt):
+            conversations.set_last_reply(user_id, response_text)
         return response_text
 
+    except SlowDown as e:
+        tracing.tag(path="slowdown")
+        return slow_down_reply(e)
     except Exception as e:
         mark_error_in_status_file()
         return f"❌ Error generating response: {str(e)}"
+
+# === Stream response using prompt ===
+async def stream_mathy_response(user_prompt: str, user_ident: str = "Unknown User", user_id: str = SYSTEM_USER_ID):
+    """Yields the reply generated so far (full text, not deltas) while Gemini streams it."""
+    response_text = ""
+    try:
+        with tracing.span("fastpath"):
+            answer = await fastmath.try_answer(user_prompt)
+        if answer is not None:
+            tracing.tag(path="fastpath")
+            add_user_prompt(user_id, user_ident, user_prompt)
+            conversations.set_last_reply(user_id, answer)
+            yield answer
+            return
+
+        shareable = is_shareable(user_prompt)
+        key = cache_key(user_prompt) if shareable else None
+        if model_user(user_id) and not (shareable and response_cache.has(key)):
+            dispatcher.check(user_id)
+        add_user_prompt(user_id, user_ident, user_prompt)
+
+        # Cache hit or an identical request already streaming: reuse its full reply
+        cached = response_cache.lookup(key) if shareable else None
+        if shareable and cached is None:
+            pending = response_cache.pending(key)
+            if pending is not None:
+                try:
+                    cached = await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    if not pending.cancelled():
+                        raise
+                    # The stream we joined was abandoned; generate our own reply below
+        if cached is not None:
+            tracing.tag(path="cache")
+            conversations.set_last_reply(user_id, cached)
+            yield cached
+            return
+
+        tracing.tag(path="model")
+        with tracing.span("prompt"):
+            if shareable:
+                full_prompt = prompt_builder.build_shared(shared_prompt(user_prompt))
+            else:
+                full_prompt = build_prompt(user_prompt, user_ident, user_id)
+        done = asyncio.get_running_loop().create_future()
+        if shareable:
+            response_cache.track(key, done)
+        started = time.perf_counter()
+        try:
+            async for piece in stream(full_prompt, user_id=model_user(user_id)):
+                if not response_text:
+                    tracing.record("model.first_piece", started)
+                response_text += piece
+                # Redact on the whole text so an ID split across pieces is still caught
+                yield response_text.replace(OWNER_ID, "`redacted`")
+        except Exception as e:
+            done.set_exception(e)
+            raise
+        else:
+            done.set_result(response_text.replace(OWNER_ID, "`redacted`"))
+            tracing.record("model.stream", started)  # includes time the consumer spent between pieces
+        finally:
+            if not done.done():
+                # The consumer stopped iterating early (generator closed)
+                done.cancel()
+
+        conversations.set_last_reply(user_id, done.result())
+
+    except SlowDown as e:
+        tracing.tag(path="slowdown")
+        yield slow_down_reply(e)
+    except Exception as e:
+        mark_error_in_status_file()
+        error_text = f"❌ Error generating response: {str(e)}"
+        if response_text:
+            yield response_text.replace(OWNER_ID, "`redacted`") + "\n\n" + error_text
+        else:
+            yield error_text
@@ -0,0 +1,490 @@
+# benchmark.py
+"""Offline load test: drives bot.py's event handlers with a fake Discord and a stub Gemini.
+
+Nothing leaves the machine: model calls go to a stub with configurable
+latency and failure rate, Discord sends/edits/reaction deletes to in-memory
+channels with a fixed delay, and the DB log writer is switched off. The bot
+runs inside a temporary directory, so its logs and snapshots don't touch
+the real ones.
+
+    python benchmark.py synthetic --requests 500 --rate 20 --users 50
+    python benchmark.py replay --speed 600 --no-rate-limit   # message_logs.jsonl at 600x
+    python benchmark.py reactions --voters 300
+    python benchmark.py daily --guilds 500                  # midnight fan-out
+
+Reports requests/sec, p50/p95/p99 reply latency, event-loop lag and RSS.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+from datetime import datetime
+
+import psutil
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_ID = 100000000000000001
+OWNER_ID = 100000000000000002
+
+SAMPLE_PROMPTS = [
+    "ping", "what is 12 x 7", "2^10 + 3", "explain the pythagorean theorem",
+    "is 0.999... equal to 1?", "derivative of x^3", "give me a hard integral",
+    "why is pi irrational", "solve x^2 - 5x + 6 = 0", "roast my math skills",
+    "what's a prime number", "help me with fractions",
+]
+
+# ---------- Stub Gemini ----------
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+class _Stream:
+    def __init__(self, pieces, delay):
+        self.pieces = pieces
+        self.delay = delay
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            await asyncio.sleep(self.delay)
+            yield _Part(piece)
+
+class StubModel:
+    """Stands in for genai.GenerativeModel: log-normal latency, a failure rate, canned text."""
+
+    def __init__(self, median, sigma, fail_rate, reply_chars=600):
+        self.median = median
+        self.sigma = sigma
+        self.fail_rate = fail_rate
+        self.reply_chars = reply_chars
+        self.calls = 0
+
+    def _latency(self):
+        return random.lognormvariate(math.log(self.median), self.sigma) if self.median > 0 else 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        latency = self._latency()
+        if random.random() < self.fail_rate:
+            await asyncio.sleep(latency / 2)
+            raise RuntimeError("stub model: 503 overloaded")
+        text = ("bruh that's easy 💅 " * (self.reply_chars // 20 + 1))[:self.reply_chars]
+        if not stream:
+            await asyncio.sleep(latency)
+            return _Part(text)
+        pieces = [text[i:i + 80] for i in range(0, len(text), 80)]
+        await asyncio.sleep(latency / 3)  # time to first piece
+        return _Stream(pieces, latency * 2 / 3 / len(pieces))
+
+# ---------- Fake Discord ----------
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def mentioned_in(self, message):
+        return any(user.id == self.id for user in message.mentions)
+
+class FakeGuild:
+    def __init__(self, members, guild_id=1):
+        self.id = guild_id
+        self.members = {member.id: member for member in members}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeSentMessage:
+    _next_id = 1
+
+    def __init__(self, channel, content):
+        self.id = FakeSentMessage._next_id
+        FakeSentMessage._next_id += 1
+        self.channel = channel
+        self.content = content
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        await asyncio.sleep(self.channel.delay)
+        self.reactions.append(emoji)
+
+    async def edit(self, content):
+        await asyncio.sleep(self.channel.delay)
+        self.content = content
+        self.channel.touch()
+
+class FakeChannel:
+    """Records when the first and last reply text became visible."""
+
+    _next_id = 1
+
+    def __init__(self, delay):
+        self.id = FakeChannel._next_id
+        FakeChannel._next_id += 1
+        self.delay = delay
+        self.sent = []
+        self.first_at = None
+        self.last_at = None
+
+    def touch(self):
+        now = time.perf_counter()
+        self.first_at = self.first_at or now
+        self.last_at = now
+
+    async def typing(self):
+        await asyncio.sleep(self.delay)
+
+    async def send(self, content, **_):
+        await asyncio.sleep(self.delay)
+        message = FakeSentMessage(self, content)
+        self.sent.append(message)
+        self.touch()
+        return message
+
+    @property
+    def text(self):
+        return "".join(message.content for message in self.sent)
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, author, content, channel, guild, mentions=()):
+        self.id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.guild = guild
+        self.mentions = list(mentions)
+        self.removed = 0
+
+    async def remove_reaction(self, emoji, member):
+        await asyncio.sleep(self.channel.delay)
+        self.removed += 1
+
+class FakeReaction:
+    def __init__(self, guild_id, message_id, user_id, emoji):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.emoji = emoji
+
+# ---------- Harness ----------
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class Probe:
+    """Samples event-loop lag (how late a 10 ms sleep wakes up) and process RSS."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self.rss = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        process = psutil.Process()
+        tick = 0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+            tick += 1
+            if tick % 10 == 0:
+                self.rss.append(process.memory_info().rss)
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.results = []  # (handler seconds, first visible seconds, reply text)
+        self.probe = Probe()
+        self.users = {}
+
+    def setup(self):
+        """Imports the bot inside a scratch directory and swaps its I/O for fakes."""
+        os.environ.setdefault("OWNER_ID", str(OWNER_ID))
+        os.environ["MATHY_STREAMING"] = "1" if self.args.streaming else "0"
+        os.environ["TRACE_SAMPLE_RATE"] = "1" if self.args.trace else "0"
+        os.environ["TRACE_SLOW_SECONDS"] = "inf"  # the report covers it; no per-request warnings
+        self.workdir = tempfile.mkdtemp(prefix="mathy-bench-")
+        os.chdir(self.workdir)
+        sys.path.insert(0, REPO_DIR)
+
+        import bot as bot_module
+        import gemini
+        import database
+        import utils
+        import tracing
+
+        logging.getLogger().setLevel(logging.WARNING)
+        self.bot_module = bot_module
+        self.gemini = gemini
+        self.tracing = tracing
+        self.stub = StubModel(self.args.model_ms / 1000, self.args.model_sigma, self.args.fail_rate)
+        for client in gemini.clients:
+            client.model = self.stub
+        if self.args.no_rate_limit:
+            gemini.dispatcher.user_rate = 1e9
+            gemini.dispatcher.user_burst = 1e9
+
+        async def log_nothing(*_):
+            return None
+        database.log_mathy_interaction = log_nothing
+        utils.interaction_log = utils.JsonlWriter(os.path.join(self.workdir, "message_logs.jsonl"))
+
+        self.bot_user = FakeUser(BOT_ID, "Mathy", bot=True)
+        bot_module.bot._connection.user = self.bot_user
+        self.guild = FakeGuild([self.bot_user])
+
+    def user(self, name):
+        user = self.users.get(name)
+        if user is None:
+            # Synthetic authors are flagged as bots so discord.py skips command parsing
+            user = self.users[name] = FakeUser(200000000000000000 + len(self.users), name, bot=True)
+            self.guild.members[user.id] = user
+        return user
+
+    async def mention(self, user, prompt):
+        channel = FakeChannel(self.args.discord_ms / 1000)
+        message = FakeMessage(user, f"<@{BOT_ID}> {prompt}", channel, self.guild, mentions=[self.bot_user])
+        started = time.perf_counter()
+        await self.bot_module.on_message(message)
+        ended = time.perf_counter()
+        first = (channel.first_at - started) if channel.first_at else ended - started
+        self.results.append((ended - started, first, channel.text))
+
+    async def open_loop(self, schedule):
+        """Fires (offset seconds, user, prompt) mentions on time, however slow replies are."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for offset, user, prompt in schedule:
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.mention(user, prompt)))
+        await asyncio.gather(*tasks)
+        return loop.time() - start
+
+    # ----- scenarios -----
+    def synthetic_schedule(self):
+        prompts = SAMPLE_PROMPTS + [entry["user_message"] for entry in load_corpus(self.args.corpus)]
+        users = [self.user(f"user{i}") for i in range(self.args.users)]
+        offset, schedule = 0.0, []
+        for _ in range(self.args.requests):
+            offset += random.expovariate(self.args.rate)  # Poisson arrivals
+            schedule.append((offset, random.choice(users), random.choice(prompts)))
+        return schedule
+
+    def replay_schedule(self):
+        entries = load_corpus(self.args.corpus)
+        if not entries:
+            raise SystemExit(f"No entries in {self.args.corpus}")
+        first = entries[0]["time"]
+        return [((entry["time"] - first).total_seconds() / self.args.speed, self.user(entry["user"]), entry["user_message"])
+                for entry in entries]
+
+    async def reactions(self):
+        """A burst of vote reactions on the daily problem, some voters changing their mind."""
+        from daily import VOTE_EMOJIS
+        bot_module = self.bot_module
+        channel = FakeChannel(self.args.discord_ms / 1000)
+        problem = FakeMessage(self.bot_user, "daily problem", channel, self.guild)
+        bot_module.daily_messages[self.guild.id] = problem
+        bot_module.vote_board.reset([problem.id])
+        bot_module.reaction_remover.start()
+
+        events = []
+        for i in range(self.args.voters):
+            user = self.user(f"voter{i}")
+            for emoji in random.sample(VOTE_EMOJIS, k=random.choice([1, 1, 1, 2, 3])):
+                events.append(FakeReaction(self.guild.id, problem.id, user.id, emoji))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for event in events:
+            await bot_module.on_raw_reaction_add(event)
+            if self.args.burst_pause:
+                await asyncio.sleep(0)
+        handled = loop.time() - started
+        deadline = loop.time() + self.args.drain_timeout
+        while bot_module.reaction_remover.pending() and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(self.args.discord_ms / 1000 * 2)
+        drained = loop.time() - started
+        await bot_module.reaction_remover.stop()
+        return {
+            "reaction_events": len(events),
+            "events_per_sec": len(events) / handled if handled else float("inf"),
+            "removals": problem.removed,
+            "removals_per_sec": problem.removed / drained if drained else 0.0,
+            "still_pending": bot_module.reaction_remover.pending(),
+            "seconds": drained,
+        }
+
+    async def daily(self):
+        """Midnight fan-out of one problem to --guilds subscribed guilds, each with its own channel."""
+        import database
+        import guilds
+        from daily import VOTE_EMOJIS
+        bot_module = self.bot_module
+
+        async def nothing(*_):
+            return None
+        async def canned_problem():
+            return "📘 **Daily Math Challenge**\n\n_Problem_: 2 + 2 = ?", "B", "🇧", (0,) * 60
+        for name in ("load_today_problem", "save_daily_problem", "add_guild_messages", "save_guild_config"):
+            setattr(database, name, nothing)
+        bot_module.take_daily_problem = canned_problem
+        bot_module.fill_problem_buffer = nothing
+
+        channels = {}
+        for i in range(self.args.guilds):
+            channel = FakeChannel(self.args.discord_ms / 1000)
+            channels[channel.id] = channel
+            await guilds.guild_configs.set(300000000000000000 + i, channel.id, 400000000000000000 + i)
+        bot_module.bot.get_channel = channels.get
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await bot_module.post_daily_problem()
+        posted = loop.time() - started
+        deadline = loop.time() + self.args.drain_timeout
+        messages = [message for channel in channels.values() for message in channel.sent]
+        while loop.time() < deadline and any(len(m.reactions) < len(VOTE_EMOJIS) for m in messages):
+            await asyncio.sleep(0.05)
+        return {
+            "guilds": self.args.guilds,
+            "posted": len(messages),
+            "posts_per_sec": len(messages) / posted if posted else float("inf"),
+            "reactions_done": sum(len(m.reactions) == len(VOTE_EMOJIS) for m in messages),
+            "posted_seconds": posted,
+            "seconds": loop.time() - started,
+        }
+
+    async def run(self):
+        self.probe.start()
+        rss_start = psutil.Process().memory_info().rss
+        extra = {}
+        if self.args.scenario in ("reactions", "daily"):
+            extra = await (self.reactions() if self.args.scenario == "reactions" else self.daily())
+            elapsed = extra["seconds"]
+        else:
+            schedule = self.synthetic_schedule() if self.args.scenario == "synthetic" else self.replay_schedule()
+            elapsed = await self.open_loop(schedule)
+        await self.probe.stop()
+        return self.report(elapsed, rss_start, extra)
+
+    def report(self, elapsed, rss_start, extra):
+        lags = [lag * 1000 for lag in self.probe.lags]
+        report = {"scenario": self.args.scenario, "seconds": round(elapsed, 2)}
+        if self.results:
+            handler = [r[0] * 1000 for r in self.results]
+            first = [r[1] * 1000 for r in self.results]
+            texts = [r[2] for r in self.results]
+            report.update({
+                "streaming": self.args.streaming,
+                "requests": len(self.results),
+                "errors": sum(text.startswith("❌") for text in texts),
+                "slowed_down": sum(text.startswith(("🐢", "🚦")) for text in texts),
+                "requests_per_sec": round(len(self.results) / elapsed, 2) if elapsed else 0.0,
+                "reply_ms": {f"p{p}": round(percentile(handler, p), 1) for p in (50, 95, 99)},
+                "first_visible_ms": {f"p{p}": round(percentile(first, p), 1) for p in (50, 95, 99)},
+                "model_calls": self.stub.calls,
+                "models": self.gemini.status(),
+            })
+        report.update({key: round(value, 2) if isinstance(value, float) else value for key, value in extra.items()})
+        report["loop_lag_ms"] = {"p50": round(percentile(lags, 50), 2), "p99": round(percentile(lags, 99), 2),
+                                 "max": round(max(lags, default=0.0), 2)}
+        report["rss_mb"] = {"start": round(rss_start / 2**20, 1),
+                            "peak": round(max(self.probe.rss, default=rss_start) / 2**20, 1)}
+        if self.args.trace:
+            report["stages"] = self.tracing.report()
+        return report
+
+def load_corpus(path):
+    """Mentions from message_logs.jsonl, oldest first, with parsed timestamps."""
+    entries = []
+    if not path or not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entry["time"] = datetime.fromisoformat(entry["timestamp"])
+            except (ValueError, KeyError):
+                continue
+            entry["user_message"] = re.sub(r"<@!?\d+>", "", entry.get("user_message", "")).strip()
+            if entry["user_message"]:
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["time"])
+    return entries
+
+def print_report(report):
+    stages = report.pop("stages", None)
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"{key:<18} {value}")
+    if stages:
+        print("\nPer-stage latency:\n" + stages)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for Mathy's message handling.")
+    parser.add_argument("scenario", choices=["synthetic", "replay", "reactions", "daily"])
+    parser.add_argument("--corpus", default=os.path.join(REPO_DIR, "message_logs.jsonl"), help="JSONL log to replay / draw prompts from")
+    parser.add_argument("--requests", type=int, default=300, help="synthetic: number of mentions")
+    parser.add_argument("--rate", type=float, default=20, help="synthetic: mean mentions per second")
+    parser.add_argument("--users", type=int, default=30, help="synthetic: distinct users")
+    parser.add_argument("--speed", type=float, default=100, help="replay: multiple of recorded speed")
+    parser.add_argument("--voters", type=int, default=200, help="reactions: users voting at once")
+    parser.add_argument("--guilds", type=int, default=500, help="daily: subscribed guilds to post to")
+    parser.add_argument("--drain-timeout", type=float, default=15, help="reactions/daily: seconds to wait for removals or vote reactions")
+    parser.add_argument("--burst-pause", action="store_true", help="reactions: yield to the loop between events")
+    parser.add_argument("--model-ms", type=float, default=1500, help="stub model median latency")
+    parser.add_argument("--model-sigma", type=float, default=0.5, help="log-normal spread of model latency")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of model calls that fail")
+    parser.add_argument("--discord-ms", type=float, default=60, help="latency of each fake Discord call")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false", help="send whole replies instead of streaming edits")
+    parser.add_argument("--no-rate-limit", action="store_true", help="lift the per-user model rate limit")
+    parser.add_argument("--trace", action="store_true", help="trace every request and print per-stage latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    harness = Harness(args)
+    harness.setup()
+    report = asyncio.run(harness.run())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
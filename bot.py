@@ -3,36 +3,52 @@ import sys
 import io
 import re
 import json
+import signal
 import asyncio
 import logging
-import subprocess
-from threading import Thread
-from datetime import datetime, time as dt_time, timedelta
+import time
+from datetime import datetime, timedelta
 
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from dotenv import load_dotenv
-from flask import Flask
 import pytz
 
-from ai import get_mathy_response  # Gemini handler (must be async)
-from daily import math_problem, math_quote, get_vote_counts
+from ai import get_mathy_response, stream_mathy_response, save_conversations, conversations, response_cache  # Gemini handlers (must be async)
+from daily import math_quote, get_vote_counts, vote_board, VOTE_EMOJIS, take_daily_problem, fill_problem_buffer
 import database  # our DB module
+import metrics
+import tracing
+import fastmath
+import gemini
+import startup
+from memory import write_atomic
+from streaming import StreamingReply
+from scheduler import Scheduler
+from reactions import ReactionRemover
+from status import bot_status
+from health import HealthServer
+from dedup import problem_index
+from handoff import handoff
+from memwatch import memory_watch
+from guilds import guild_configs, FanOut, send_to_guilds, add_reactions, ping
 
 # Import utilities
 from utils import (
     set_error_flag,
     reset_status,
     log_interaction,
+    interaction_log,
+    discord_latency,
     chunk_message,
     replace_mentions_with_usernames,
-    STATUS_FILE,
     IST
 )
 
 # ---------- Environment ----------
 load_dotenv()
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+STREAM_REPLIES = os.getenv("MATHY_STREAMING", "1") == "1"  # edit replies in as they generate
 
 # ---------- Logging ----------
 os.makedirs("logs", exist_ok=True)
@@ -52,211 +68,397 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='repla
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
 # ---------- Globals ----------
-last_sent_date = None
-sent_message = False
-daily_problem_message = None
+daily_messages = {}  # guild_id -> today's problem message in that guild
 correct_answer_letter = None
 correct_answer_option = None
 problem = None
-
-# ---------- Flask Keep-Alive ----------
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return 'Mathy bot is alive!'
-
-def run_flask():
-    app.run(host='0.0.0.0', port=8080)
-
-flask_thread = Thread(target=run_flask, daemon=True)
-flask_thread.start()
+initialized = False  # on_ready's one-time setup has run; later on_ready calls are gateway reconnects
 
 # ---------- Discord Bot ----------
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix=commands.when_mentioned, intents=intents)
-
-# ---------- Restart & Uptime ----------
-async def restart_at_safe_time(hour=2, minute=30):
-    while True:
-        now_ist = datetime.now(pytz.utc).astimezone(IST)
-        restart_time = now_ist.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if now_ist >= restart_time:
-            restart_time += timedelta(days=1)
-        wait_seconds = (restart_time - now_ist).total_seconds()
-        hours = int(wait_seconds // 3600)
-        minutes = int((wait_seconds % 3600) // 60)
-        print(f"[Restart Scheduler] Waiting {hours} hrs {minutes} mins until {hour:02d}:{minute:02d} IST...")
-        await asyncio.sleep(wait_seconds)
-        print("[Restart Scheduler] Restarting now...")
-        os.execv(sys.executable, [sys.executable] + sys.argv)
-
-async def uptime_watcher(hours=12):
-    await asyncio.sleep(hours * 3600)
-    print(f"[Uptime Watcher] {hours} hours reached, scheduling restart...")
-    asyncio.create_task(restart_at_safe_time())
 
-# ---------- Daily Problem Scheduler ----------
-@tasks.loop(minutes=1)
-async def daily_problem_scheduler():
-    global last_sent_date, daily_problem_message, correct_answer_letter, correct_answer_option, problem, sent_message
-
-    now_ist = datetime.now(pytz.utc).astimezone(IST)
-    today_date = now_ist.date()
+class MathyBot(commands.Bot):
+    async def setup_hook(self):
+        # Render/Docker stop the container with SIGTERM; shut down cleanly so queued logs get flushed
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except (NotImplementedError, RuntimeError):
+            pass  # not supported on Windows
+        bot_status.start()  # heartbeat + pidfile for status_monitor.py
+        memory_watch.start()
+        # Heavy imports and the sympy worker load while the gateway connects
+        asyncio.create_task(preload_models())
+        asyncio.create_task(fastmath.sandbox.warm_up())
+        try:
+            await self.health.start()
+        except OSError as e:
+            logger.error(f"❌ Health server failed to start: {e}")
+
+    async def close(self):
+        # Finish replies in progress, then leave today's state for the next process
+        await handoff.drain()
+        await reaction_remover.stop()
+        try:
+            handoff.save(runtime_state())
+        except Exception as e:
+            logger.error(f"❌ Runtime snapshot failed: {e}")
+        await self.health.stop()
+        try:
+            await save_conversations()
+        except Exception as e:
+            logger.error(f"❌ Conversation snapshot failed: {e}")
+        try:
+            await database.shutdown()
+        except Exception as e:
+            logger.error(f"❌ DB shutdown failed: {e}")
+        await asyncio.to_thread(interaction_log.close)
+        fastmath.sandbox.close()
+        memory_watch.stop()
+        bot_status.stop()
+        await super().close()
+
+async def preload_models():
+    with startup.phase("gemini sdk"):
+        try:
+            await asyncio.to_thread(gemini.preload)
+        except Exception as e:
+            logger.error(f"❌ Gemini SDK failed to load: {e}")
+
+bot = MathyBot(command_prefix=commands.when_mentioned, intents=intents)
+bot.health = HealthServer(bot)  # /, /healthz, /readyz and /metrics on PORT
+bot.restart_requested = False  # set by hot_restart; the process re-executes itself once the bot has closed
+
+# ---------- Scheduler ----------
+# One heap of IST deadlines for every timed job; last runs are kept in the DB for catch-up
+scheduler = Scheduler(load_runs=database.load_job_runs, save_run=database.record_job_run)
+
+# ---------- Restart ----------
+async def hot_restart(reason):
+    """Drains, snapshots and closes the bot (see MathyBot.close), then re-executes it in the same process.
+
+    The re-executed process still starts cold and identifies with the gateway
+    again: only the handed-off state survives, not the gateway session.
+    """
+    logger.info(f"🔁 Restarting: {reason}")
+    bot.restart_requested = True
+    await bot.close()
+
+# Restarts clear memory growth; with RESTART_RSS_GROWTH_MB set, nights with little growth are skipped
+@scheduler.daily("restart", hour=2, minute=30)
+async def restart_at_safe_time():
+    restart, why = memory_watch.should_restart()
+    if not restart:
+        logger.info(f"🧠 Skipping nightly restart: {why}.")
+        return
+    await hot_restart(why)
+
+# ---------- Conversation Memory ----------
+@scheduler.cron("conversation_snapshot", "*/15 * * * *")
+async def snapshot_conversations():
+    await save_conversations()
+
+# ---------- Log Retention ----------
+@scheduler.daily("log_maintenance", hour=3, minute=15, grace=24 * 3600)
+async def maintain_logs():
+    created, dropped = await database.maintain_log_partitions()
+    if created or dropped:
+        logger.info(f"🗂️ mathy_logs partitions created: {created or 'none'}, dropped: {dropped or 'none'}")
+
+# ---------- Daily Problem ----------
+# A late start (e.g. after a crash at midnight) still posts within 6 hours
+@scheduler.daily("daily_problem", hour=0, minute=0, grace=6 * 3600)
+async def post_daily_problem():
+    global correct_answer_letter, correct_answer_option, problem
+
+    today_date = datetime.now(pytz.utc).astimezone(IST).date()
+    try:
+        today_data = await database.load_today_problem(today_date)
+    except Exception as e:
+        logger.warning(f"⚠ Could not check for today's problem, posting anyway: {e}")
+        today_data = None
 
-    # Next 00:00 IST
-    if now_ist.time() < dt_time(0, 0):
-        next_window = datetime.combine(today_date, dt_time(0, 0, 0))
+    configs = guild_configs.all()
+    if today_data:
+        # Finish a fan-out cut short by a restart rather than posting a second problem
+        posted = {int(guild_id) for guild_id in today_data["guild_messages"] or {}}
+        configs = [config for config in configs if config.guild_id not in posted]
+        if not configs or (not posted and today_data["message_id"]):  # row from before per-guild posts
+            logger.info("ℹ️ Today's problem was already posted, skipping.")
+            return
+        problem = today_data["problem_text"]
+        correct_answer_letter = today_data["correct_answer_letter"]
+        correct_answer_option = today_data["correct_answer_option"]
+        logger.info(f"↪️ Posting today's problem to {len(configs)} remaining guild(s).")
+    elif not configs:
+        logger.error("❌ No guilds are subscribed to the daily problem.")
+        set_error_flag(True)
+        return
     else:
-        next_window = datetime.combine(today_date + timedelta(days=1), dt_time(0, 0, 0))
-    next_window = IST.localize(next_window)
-
-    wait_seconds = (next_window - now_ist).total_seconds()
-
-    # Send between 00:00–00:30 IST
-    if dt_time(0, 0) <= now_ist.time() <= dt_time(0, 30) and last_sent_date != today_date:
-        channel = bot.get_channel(1402996264278298695)
-        if channel:
-            try:
-                problem = await math_problem()
-
-                match = re.search(r"Correct Answer:\s*([A-D])", problem, re.IGNORECASE)
-                if match:
-                    correct_answer_letter = match.group(1).upper()
-                    problem = re.sub(r"Correct Answer:\s*[A-D]\s*", "", problem, flags=re.IGNORECASE).strip()
-                else:
-                    correct_answer_letter = None
-
-                LETTER_TO_EMOJI = {'A': '🇦', 'B': '🇧', 'C': '🇨', 'D': '🇩'}
-                correct_answer_option = LETTER_TO_EMOJI.get(correct_answer_letter)
-
-                # scrub stray checkmarks if model adds them
-                problem = problem.replace("\u2714", "")
-
-                daily_problem_message = await channel.send("<@&1378364940322345071>\n\n" + problem)
-                logger.info(f"📤 Daily problem sent (Answer: {correct_answer_letter}, emoji: {correct_answer_option})")
-
-                database.save_daily_problem(today_date, problem, correct_answer_letter, correct_answer_option, daily_problem_message.id)
-
-                for emoji in ['🇦', '🇧', '🇨', '🇩']:
-                    await daily_problem_message.add_reaction(emoji)
-
-                last_sent_date = today_date
-                sent_message = False
-            except Exception as e:
-                logger.error(f"❌ Failed to send daily problem: {e}")
-                set_error_flag(True)
-        else:
-            logger.error("❌ Channel not found.")
+        # Pre-generated and already parsed, so no model call on the midnight path
+        problem, correct_answer_letter, correct_answer_option, sig = await take_daily_problem()
+        problem_index.add(sig, str(today_date))
+        daily_messages.clear()
+        vote_board.reset()
+        try:
+            await database.save_daily_problem(today_date, problem, correct_answer_letter, correct_answer_option, None, list(sig))
+        except Exception as e:
+            logger.error(f"❌ Could not save today's problem, posting anyway: {e}")
+
+    fan = FanOut()
+    started = time.perf_counter()
+    sent, failed = await send_to_guilds(bot, configs, problem, fan)
+    logger.info(
+        f"📤 Daily problem sent to {len(sent)}/{len(configs)} guild(s) in {time.perf_counter() - started:.1f}s "
+        f"(Answer: {correct_answer_letter}, emoji: {correct_answer_option})"
+    )
+    for guild_id, message in sent.items():
+        daily_messages[guild_id] = message
+        vote_board.track(message.id)
+    if sent:
+        try:
+            await database.add_guild_messages(today_date, {guild_id: [m.channel.id, m.id] for guild_id, m in sent.items()})
+        except Exception as e:
+            logger.error(f"❌ Could not record daily problem message IDs: {e}")
             set_error_flag(True)
     else:
-        if not sent_message:
-            hours = int(wait_seconds // 3600)
-            minutes = int((wait_seconds % 3600) // 60)
-            msg = (f"⏳ Sleeping {hours} hrs {minutes} mins until 12:00 AM IST..."
-                   if minutes else f"⏳ Sleeping {hours} hrs until 12:00 AM IST...")
-            print(msg)
-            sent_message = True
+        set_error_flag(True)
+        raise RuntimeError(f"daily problem reached none of {len(failed)} guild(s)")
+
+    # Reactions trail the posts instead of holding them up
+    asyncio.create_task(add_reactions(sent.values(), VOTE_EMOJIS, fan))
+    asyncio.create_task(fill_problem_buffer())
 
 async def init_daily_problem():
-    global problem, correct_answer_letter, correct_answer_option, daily_problem_message
+    global problem, correct_answer_letter, correct_answer_option
     now_ist = datetime.now(pytz.utc).astimezone(IST)
-    today_data = database.load_today_problem(now_ist.date())
-    if today_data:
-        problem = today_data['problem_text']
-        correct_answer_letter = today_data['correct_answer_letter']
-        correct_answer_option = today_data['correct_answer_option']
-        try:
-            channel = bot.get_channel(1402996264278298695)
-            daily_problem_message = await channel.fetch_message(today_data['message_id'])
-            logger.info("✅ Loaded today's problem from DB.")
-        except Exception as e:
-            logger.warning(f"⚠ Could not fetch message: {e}")
-            daily_problem_message = None
-    else:
+    today_data = await database.load_today_problem(now_ist.date())
+    if not today_data:
         logger.info("ℹ️ No problem stored for today.")
+        return
+    problem = today_data['problem_text']
+    correct_answer_letter = today_data['correct_answer_letter']
+    correct_answer_option = today_data['correct_answer_option']
+
+    # Partial messages need no API call; only reconciling the votes fetches each one
+    daily_messages.clear()
+    for guild_id, (channel_id, message_id) in (today_data['guild_messages'] or {}).items():
+        daily_messages[int(guild_id)] = bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+    vote_board.reset(message.id for message in daily_messages.values())
+    logger.info(f"✅ Loaded today's problem from DB ({len(daily_messages)} guild(s)).")
+    asyncio.create_task(reconcile_votes(FanOut()))
+
+async def reconcile_votes(fan):
+    """Rebuilds every guild's tally from its message's reactions and queues removal of extra votes."""
+    async def reconcile(message):
+        full = await fan.call(message.fetch)
+        tally = vote_board.get(message.id)
+        await tally.reconcile(full, bot.user.id)
+        for user_id, held in tally.reactions.items():
+            if len(held) > 1:
+                reaction_remover.schedule(message, user_id)
+
+    results = await fan.map(list(daily_messages.values()), reconcile)
+    failures = [e for e in results.values() if isinstance(e, BaseException)]
+    if failures:
+        logger.warning(f"⚠ Could not fetch {len(failures)} daily problem message(s): {failures[0]}")
+    logger.info(f"🗳️ Reconciled {sum(len(t.reactions) for t in vote_board.tallies.values())} votes from reactions.")
+
+def runtime_state():
+    """Today's problem, votes and pending reaction removals, for the next process to pick up."""
+    return {
+        "date": str(datetime.now(pytz.utc).astimezone(IST).date()),
+        "daily": {
+            "problem": problem,
+            "letter": correct_answer_letter,
+            "option": correct_answer_option,
+            "messages": {str(guild_id): [m.channel.id, m.id] for guild_id, m in daily_messages.items()},
+            "votes": {str(message_id): tally.reactions for message_id, tally in vote_board.tallies.items()},
+        },
+        "reaction_jobs": [[message.id, user_id] for message, user_id in reaction_remover.jobs()],
+        "memory": {"rss": memory_watch.rss(), "growth": memory_watch.growth()},
+    }
 
-async def schedule_midnight_vote_summary():
-    await bot.wait_until_ready()
-    await init_daily_problem()
-    channel = bot.get_channel(1402996264278298695)
-
-    while not bot.is_closed():
-        now_ist = datetime.now(pytz.utc).astimezone(IST)
-        target = IST.localize(datetime.combine(now_ist.date(), dt_time(23, 0, 0)))
-        if now_ist >= target:
-            target += timedelta(days=1)
-        wait_seconds = (target - now_ist).total_seconds()
-
-        logger.info("⏳ Sleeping until 11:00 PM IST for vote summary...")
-        await asyncio.sleep(wait_seconds)
-
-        global daily_problem_message, correct_answer_option, problem
-        if daily_problem_message and correct_answer_option and channel:
-            try:
-                results = await get_vote_counts(daily_problem_message)
-                if results:
-                    total_votes = sum(results.values())
-                    correct_votes = results.get(correct_answer_option, 0)
-                    summary = (
-                        f"📊 **Daily problem voting summary:**\n"
-                        f"Total votes: {total_votes}\n"
-                        f"Correct votes ({correct_answer_option}): {correct_votes}\n"
-                        f"Votes breakdown:\n" +
-                        "".join(f"{emoji}: {count}\n" for emoji, count in results.items())
-                    )
-
-                    prompt_for_result = f"""{problem}
+def restore_runtime_state(state):
+    """Takes over today's problem from a handoff snapshot; False if it is for another day."""
+    global problem, correct_answer_letter, correct_answer_option
+    daily = state.get("daily") or {}
+    if state.get("date") != str(datetime.now(pytz.utc).astimezone(IST).date()) or not daily.get("messages"):
+        return False
+    problem, correct_answer_letter, correct_answer_option = daily["problem"], daily["letter"], daily["option"]
+
+    daily_messages.clear()
+    for guild_id, (channel_id, message_id) in daily["messages"].items():
+        daily_messages[int(guild_id)] = bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+    vote_board.reset(message.id for message in daily_messages.values())
+    for message_id, reactions in daily.get("votes", {}).items():
+        tally = vote_board.get(int(message_id))
+        if tally is not None:
+            tally.reactions = {int(user_id): held for user_id, held in reactions.items()}
+
+    by_id = {message.id: message for message in daily_messages.values()}
+    jobs = [(by_id[message_id], user_id) for message_id, user_id in state.get("reaction_jobs", []) if message_id in by_id]
+    for message, user_id in jobs:
+        reaction_remover.schedule(message, user_id)
+    logger.info(f"♻️ Restored today's problem ({len(daily_messages)} guild(s)) and {len(jobs)} pending reaction removals.")
+    return True
+
+def vote_breakdown(counts, option):
+    total_votes = sum(counts.values())
+    return (
+        f"Total votes: {total_votes}\n"
+        f"Correct votes ({option}): {counts.get(option, 0)}\n"
+        f"Votes breakdown:\n" +
+        "".join(f"{emoji}: {count}\n" for emoji, count in counts.items())
+    )
+
+@scheduler.daily("vote_summary", hour=23, minute=0, grace=30 * 60)
+async def send_vote_summary():
+    global correct_answer_option, problem
+    targets = [(guild_configs.get(guild_id), message) for guild_id, message in daily_messages.items()]
+    targets = [(config, message) for config, message in targets if config is not None]
+    if not (targets and correct_answer_option):
+        logger.info("ℹ️ No active daily problem for midnight summary.")
+        return
+    try:
+        # One roast for everyone, from the combined votes; each guild also gets its own numbers
+        summary = f"📊 **Daily problem voting summary ({len(targets)} servers):**\n" + vote_breakdown(vote_board.counts(), correct_answer_option)
+        prompt_for_result = f"""{problem}
 
 {summary}
 
 Roast them if bad or solve the problem. Keep under 1000 characters."""
-                    response = await get_mathy_response(prompt_for_result)
-                    await channel.send("<@&1378364940322345071> \n \n" + response)
-                    logger.info("✅ Sent midnight vote summary.")
-                else:
-                    await channel.send("No votes data available for midnight summary.")
-            except Exception as e:
-                logger.error(f"❌ Error sending midnight summary: {e}")
-                set_error_flag(True)
-        else:
-            logger.info("ℹ️ No active daily problem for midnight summary.")
+        response = await get_mathy_response(prompt_for_result)
+
+        fan = FanOut()
+
+        async def send(target):
+            config, message = target
+            counts = await get_vote_counts(message)
+            here = "📊 **Votes here:**\n" + vote_breakdown(counts, correct_answer_option) if counts else ""
+            channel = bot.get_channel(config.channel_id)
+            if channel is None:
+                raise LookupError(f"channel {config.channel_id} not found")
+            await fan.call(channel.send, ping(config) + here + "\n" + response)
+
+        results = await fan.map(targets, send)
+        failures = [e for e in results.values() if isinstance(e, BaseException)]
+        if failures:
+            logger.warning(f"⚠ Vote summary failed in {len(failures)} guild(s): {failures[0]}")
+        logger.info(f"✅ Sent midnight vote summary to {len(targets) - len(failures)} guild(s).")
+    except Exception as e:
+        logger.error(f"❌ Error sending midnight summary: {e}")
+        set_error_flag(True)
+        raise
+
+# ---------- Presence ----------
+PRESENCE_CACHE = os.getenv("PRESENCE_CACHE", "presence.json")  # last status quote, shown at once on startup
+PRESENCE_MAX_AGE = 6 * 3600  # older cached quotes are replaced by a fresh one from the model
+ACTIVITY_TYPES = {
+    "Playing": discord.ActivityType.playing,
+    "Listening to": discord.ActivityType.listening,
+    "Watching": discord.ActivityType.watching
+}
+
+async def set_presence(quote, activity_type_str):
+    activity_type = ACTIVITY_TYPES.get(activity_type_str, discord.ActivityType.playing)
+    await bot.change_presence(activity=discord.Activity(type=activity_type, name=quote))
+    logger.info(f"🧠 Status set to: {quote}")
+
+def cached_presence():
+    """(quote, activity type, age in seconds) from the previous run, or None."""
+    try:
+        with open(PRESENCE_CACHE, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        return saved["quote"], saved["type"], time.time() - os.path.getmtime(PRESENCE_CACHE)
+    except (OSError, ValueError, KeyError):
+        return None
+
+async def show_presence():
+    """Shows the cached quote straight away; asks the model for a new one only if it is stale or missing."""
+    cached = cached_presence()
+    try:
+        if cached:
+            await set_presence(cached[0], cached[1])
+            if cached[2] < PRESENCE_MAX_AGE:
+                return
+        with startup.phase("presence quote"):
+            quote, activity_type_str = await math_quote()
+            if quote.startswith("❌"):
+                # The model call failed; keep whatever is showing (and cached) rather than an error text
+                logger.warning(f"⚠ Presence quote unavailable, keeping the previous one: {quote}")
+                return
+            quote = quote.replace(activity_type_str, "").replace("*", "").replace(".", "")
+            await set_presence(quote, activity_type_str)
+        write_atomic(PRESENCE_CACHE, json.dumps({"quote": quote, "type": activity_type_str}))
+    except Exception as e:
+        logger.error(f"❌ Failed to set status: {e}")
+        set_error_flag(True)
 
 # ---------- Events ----------
+async def load_guild_configs():
+    with startup.phase("guild configs"):
+        try:
+            await guild_configs.load()
+            await guild_configs.seed_home(bot)
+        except Exception as e:
+            logger.error(f"❌ Failed to load guild configs: {e}")
+            set_error_flag(True)
+
+async def load_problem_index():
+    with startup.phase("problem index"):
+        try:
+            await problem_index.load()
+        except Exception as e:
+            logger.error(f"❌ Failed to index past problems: {e}")
+
+async def load_daily_state():
+    with startup.phase("daily problem"):
+        state = handoff.load()
+        if state:
+            memory = state.get("memory", {})
+            logger.info(f"♻️ Handoff from pid {state.get('pid')}: it used {memory.get('rss', 0) / 2**20:.0f} MB "
+                        f"({memory.get('growth', 0) / 2**20:+.0f} MB since its baseline).")
+        try:
+            if state and restore_runtime_state(state):
+                # Only votes cast during the restart are missing; catch up on them slowly in the background
+                asyncio.create_task(reconcile_votes(FanOut(rate=5, concurrency=2)))
+            else:
+                await init_daily_problem()
+        except Exception as e:
+            logger.error(f"❌ Failed to load today's problem: {e}")
+
 @bot.event
 async def on_ready():
+    global initialized
+    startup.mark("gateway ready")
     logger.info(f"✅ Logged in as {bot.user}")
     reset_status()
+    asyncio.create_task(show_presence())
 
-    try:
-        database.init_db()
-        logger.info("🗄️ Database initialized.")
-    except Exception as e:
-        logger.error(f"❌ DB init failed: {e}")
-        set_error_flag(True)
+    # Reconnects fire on_ready again; reloading would reset vote tallies and refetch every message
+    if initialized:
+        logger.info("🔌 Reconnected to the gateway, keeping the loaded state.")
+        return
+    initialized = True
 
-    activity_map = {
-        "Playing": discord.ActivityType.playing,
-        "Listening to": discord.ActivityType.listening,
-        "Watching": discord.ActivityType.watching
-    }
-    try:
-        quote, activity_type_str = await math_quote()
-        activity_type = activity_map.get(activity_type_str, discord.ActivityType.playing)
-        quote = quote.replace(activity_type_str, "").replace("*", "").replace(".", "")
-        await bot.change_presence(activity=discord.Activity(type=activity_type, name=quote))
-        logger.info(f"🧠 Status set to: {quote}")
-    except Exception as e:
-        logger.error(f"❌ Failed to set status: {e}")
-        set_error_flag(True)
+    with startup.phase("db init"):
+        try:
+            await database.init_db()
+            logger.info("🗄️ Database initialized.")
+        except Exception as e:
+            logger.error(f"❌ DB init failed: {e}")
+            set_error_flag(True)
 
-    bot.loop.create_task(schedule_midnight_vote_summary())
-    daily_problem_scheduler.start()
-    asyncio.create_task(restart_at_safe_time())
-#   bot.loop.create_task(reaction_worker())
-    print("Reaction worker started")
+    # Each only needs the tables; the scheduler waits for all three since its catch-up runs use them
+    await asyncio.gather(load_guild_configs(), load_problem_index(), load_daily_state())
+    with startup.phase("scheduler"):
+        await scheduler.start()
+    reaction_remover.start()
+    asyncio.create_task(fill_problem_buffer())  # after the problem index, which it checks against
+    if startup.mark("ready"):
+        logger.info("🚀 Startup timeline:\n" + startup.report())
 
 @bot.event
 async def on_member_join(member):
@@ -268,77 +470,68 @@ async def on_member_join(member):
     else:
         print(f"Role '{role_name}' not found")
 
-reaction_queue = asyncio.Queue()
-
-# Worker task: processes reaction removals one at a time
-async def reaction_worker():
-    while True:
-        reaction, user = await reaction_queue.get()
+@bot.event
+async def on_guild_remove(guild):
+    if guild_configs.get(guild.id):
         try:
-            await asyncio.sleep(0.6)  # small delay to let Discord register properly
-            await reaction.remove(user)
-        except discord.Forbidden:
-            print("❌ Missing permission to remove reaction")
-        except discord.NotFound:
-            # reaction already gone
-            pass
+            await guild_configs.remove(guild.id)
+            logger.info(f"🏠 Left guild {guild.id}, unsubscribed it from the daily problem.")
         except Exception as e:
-            print(f"⚠️ Error removing reaction: {e}")
-        finally:
-            reaction_queue.task_done()
+            logger.error(f"❌ Could not unsubscribe guild {guild.id}: {e}")
+
+# Removes superseded votes (single-vote rule), paced per channel
+reaction_remover = ReactionRemover(vote_board)
 
 @bot.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
     if payload.user_id == bot.user.id:
         return
 
-    global daily_problem_message
-    if not daily_problem_message or payload.message_id != daily_problem_message.id:
-        return
-
-    valid_choices = {"🇦", "🇧", "🇨", "🇩"}
-    if str(payload.emoji) not in valid_choices:
+    tally = vote_board.get(payload.message_id)
+    if tally is None:
         return
 
-    channel = bot.get_channel(payload.channel_id)
-    if not channel:
+    emoji = str(payload.emoji)
+    if emoji not in VOTE_EMOJIS:
         return
 
-    try:
-        message = await channel.fetch_message(payload.message_id)
-        user = message.guild.get_member(payload.user_id)
-        if not user:
-            return
+    # ✅ Count the vote and schedule removal of the user's other choices
+    message = daily_messages.get(payload.guild_id)
+    if tally.add(payload.user_id, emoji) and message is not None:
+        reaction_remover.schedule(message, payload.user_id)
 
-        # ✅ Enqueue removal of ALL other reactions (processed in worker)
-        for reaction in message.reactions:
-            emoji_str = str(reaction.emoji)
-            if emoji_str in valid_choices and emoji_str != str(payload.emoji):
-                await reaction_queue.put((reaction, user))
-
-    except Exception as e:
-        print(f"on_raw_reaction_add error: {e}")
+@bot.event
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    tally = vote_board.get(payload.message_id)
+    if tally is not None:
+        tally.remove(payload.user_id, str(payload.emoji))
 
 @bot.command()
 async def restart(ctx):
     if ctx.author.id == OWNER_ID and OWNER_ID != 0:
-        print("🔁 Restarting Mathy in 5 seconds...")
-        python = sys.executable
-        script = os.path.abspath(sys.argv[0])
-        await asyncio.sleep(5)
-        subprocess.Popen([python, script])
-        await bot.close()
+        await ctx.send("🔁 Restarting Mathy, back in a few seconds...")
+        await hot_restart(f"requested by {ctx.author}")
     else:
         await ctx.send("🚫 You don't have permission to restart the bot.")
 
+@bot.command()
+async def memory(ctx):
+    """RSS over time and the sizes of Mathy's caches (owner only)."""
+    if ctx.author.id != OWNER_ID or OWNER_ID == 0:
+        await ctx.send("🚫 You don't have permission to view memory stats.")
+        return
+    for chunk in chunk_message(memory_watch.report(), limit=1900):
+        await ctx.send(f"```\n{chunk}\n```")
+
 @bot.command()
 async def votes(ctx):
-    global daily_problem_message, correct_answer_option
-    if daily_problem_message is None:
+    global correct_answer_option
+    message = daily_messages.get(ctx.guild.id) if ctx.guild else None
+    if message is None:
         await ctx.send("No active daily problem message found.")
         return
 
-    counts = await get_vote_counts(daily_problem_message)
+    counts = await get_vote_counts(message)
     if not counts:
         await ctx.send("No votes yet!")
         return
@@ -350,35 +543,131 @@ async def votes(ctx):
         response += f"\n✅ Correct option {correct_answer_option} has {correct_votes}/{total_votes} votes."
     await ctx.send(response)
 
-@bot.event
-async def on_message(message: discord.Message):
-    if message.author == bot.user:
+@bot.command()
+@commands.guild_only()
+@commands.has_guild_permissions(manage_guild=True)
+async def dailysetup(ctx, channel: discord.TextChannel, role: discord.Role = None):
+    """Posts the daily problem in `channel` from now on, pinging `role` if given."""
+    await guild_configs.set(ctx.guild.id, channel.id, role.id if role else None)
+    pinged = f", pinging {role.mention}" if role else ""
+    await ctx.send(f"✅ Daily problem will be posted in {channel.mention}{pinged}.",
+                   allowed_mentions=discord.AllowedMentions.none())
+
+@bot.command()
+@commands.guild_only()
+@commands.has_guild_permissions(manage_guild=True)
+async def dailystop(ctx):
+    """Stops posting the daily problem in this server."""
+    if await guild_configs.remove(ctx.guild.id) is None:
+        await ctx.send("This server isn't subscribed to the daily problem.")
         return
+    await ctx.send("🛑 Daily problem turned off for this server.")
 
-    if bot.user.mentioned_in(message):
-        with open(STATUS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"flash_both": True, "timestamp": asyncio.get_event_loop().time()}, f)
+@bot.command()
+async def history(ctx, user: discord.User, limit: int = 5):
+    """A user's last interactions with Mathy (owner only)."""
+    if ctx.author.id != OWNER_ID or OWNER_ID == 0:
+        await ctx.send("🚫 You don't have permission to view interaction logs.")
+        return
+    rows = await database.recent_user_logs(user.id, max(1, min(limit, 20)))
+    if not rows:
+        await ctx.send(f"No logged interactions for {user}.")
+        return
+    lines = [f"`{row['timestamp']:%Y-%m-%d %H:%M}` {(row['question'] or '')[:150]}" for row in rows]
+    for chunk in chunk_message(f"**Last {len(rows)} from {user}:**\n" + "\n".join(lines)):
+        await ctx.send(chunk, allowed_mentions=discord.AllowedMentions.none())
 
-        prompt = message.content.replace(f"<@{bot.user.id}>", "").strip()
-        try:
-            await message.channel.typing()
-            response = await get_mathy_response(prompt, str(message.author), str(message.author.id))
-            response = re.sub(r"`<@(\d{18})>`", r"<@\1>", response)
+@bot.command()
+async def activity(ctx, days: int = 7):
+    """Most active users over the last `days` days (owner only)."""
+    if ctx.author.id != OWNER_ID or OWNER_ID == 0:
+        await ctx.send("🚫 You don't have permission to view interaction logs.")
+        return
+    end = datetime.utcnow()
+    rows = await database.log_activity(end - timedelta(days=max(days, 1)), end, 10)
+    if not rows:
+        await ctx.send(f"No interactions in the last {days} days.")
+        return
+    lines = [f"{row['username']}: {row['interactions']} (last {row['last_seen']:%Y-%m-%d})" for row in rows]
+    await ctx.send(f"**Most active, last {days} days:**\n" + "\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
+
+@bot.command(name="startup")
+async def startup_report(ctx):
+    """How long each startup phase took in this process (owner only)."""
+    if ctx.author.id != OWNER_ID or OWNER_ID == 0:
+        await ctx.send("🚫 You don't have permission to view startup stats.")
+        return
+    await ctx.send(f"```\n{startup.report()}\n```")
+
+@bot.command()
+async def latency(ctx):
+    """Per-stage reply latency over recent traced requests (owner only)."""
+    if ctx.author.id != OWNER_ID or OWNER_ID == 0:
+        await ctx.send("🚫 You don't have permission to view latency stats.")
+        return
+    await ctx.send(f"```\n{tracing.report()}\n```")
 
+def restore_mentions(text: str) -> str:
+    """Turns `<@id>` code spans from the model back into real mentions."""
+    return re.sub(r"`<@(\d{18})>`", r"<@\1>", text)
+
+async def stream_reply(message: discord.Message, prompt: str) -> str:
+    """Streams Mathy's answer into the channel and returns the final text."""
+    reply = StreamingReply(message.channel)
+    async for partial in stream_mathy_response(prompt, str(message.author), str(message.author.id)):
+        await reply.update(restore_mentions(partial))
+    await reply.finish()
+    return reply.text
+
+async def handle_mention(message: discord.Message):
+    bot_status.flash()
+
+    prompt = message.content.replace(f"<@{bot.user.id}>", "").strip()
+    replied = False
+    try:
+        with tracing.span("typing"):
+            await message.channel.typing()
+        with tracing.span("reply"):
+            if STREAM_REPLIES:
+                response = await stream_reply(message, prompt)
+                replied = True
+            else:
+                response = await get_mathy_response(prompt, str(message.author), str(message.author.id))
+                response = restore_mentions(response)
+
+        with tracing.span("clean_mentions"):
             cleaned_message = await replace_mentions_with_usernames(message)
             cleaned_message = cleaned_message.replace("@MathMinds Bot", "@Mathy").replace("*", "").replace("`", "")
 
-            database.log_mathy_interaction(message.author.id, str(message.author), cleaned_message, response)
-        except Exception as e:
-            response = f"❌ Error generating response: {str(e)}"
-            logger.error(f"Error in get_mathy_response: {e}")
-            set_error_flag(True)
+        await database.log_mathy_interaction(message.author.id, str(message.author), cleaned_message, response)
+    except Exception as e:
+        response = f"❌ Error generating response: {str(e)}"
+        logger.error(f"Error in get_mathy_response: {e}")
+        set_error_flag(True)
 
-        for chunk in chunk_message(response):
-            await message.channel.send(chunk)
+    if not replied:
+        with tracing.span("send"):
+            for chunk in chunk_message(response):
+                with metrics.timer(discord_latency, op="send"):
+                    await message.channel.send(chunk)
 
-        log_interaction(message.author, prompt, response)
-        logger.info(f"Responded to {message.author}: {prompt}")
+    log_interaction(message.author, prompt, response)
+    logger.info(f"Responded to {message.author}: {prompt}")
+    if startup.mark("first reply"):
+        logger.info(f"🚀 First reply {startup.since_start():.2f}s after process start.")
+
+@bot.event
+async def on_message(message: discord.Message):
+    if message.author == bot.user:
+        return
+
+    if bot.user.mentioned_in(message):
+        if handoff.draining:
+            await message.channel.send("🔁 Restarting, ask me again in a few seconds!")
+            return
+        async with handoff.working():
+            with tracing.trace("mention", user=message.author.id, streaming=STREAM_REPLIES):
+                await handle_mention(message)
 
     await bot.process_commands(message)
 
@@ -386,7 +675,28 @@ async def on_message(message: discord.Message):
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
         return
+    if isinstance(error, (commands.MissingPermissions, commands.NoPrivateMessage)):
+        await ctx.send("🚫 You need Manage Server in a server to change the daily problem.")
+        return
+    if isinstance(error, (commands.BadArgument, commands.MissingRequiredArgument)):
+        await ctx.send(f"Usage: `@Mathy {ctx.command.name} {ctx.command.signature}`")
+        return
     raise error
 
+# What the memory report breaks RSS growth down by
+memory_watch.track("conversations", conversations.stats)
+memory_watch.track("reply_cache", lambda: len(response_cache))
+memory_watch.track("votes", lambda: sum(len(tally.reactions) for tally in vote_board.tallies.values()))
+memory_watch.track("reactions", reaction_remover.pending)
+memory_watch.track("jsonl_log", lambda: interaction_log.stats()["pending"])
+
+startup.mark("imports")
+
 # ---------- Run Bot ----------
-bot.run(os.getenv("DISCORD_TOKEN"))
+if __name__ == "__main__":
+    bot.run(os.getenv("DISCORD_TOKEN"))
+    if bot.restart_requested:
+        # Same PID, so the status monitor's pidfile stays valid; startup timings restart from here.
+        # Exec starts a fresh interpreter, so imports and the gateway identify are paid again.
+        os.environ["MATHY_STARTED"] = str(time.time())
+        os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -0,0 +1,110 @@
+# cache.py
+import time
+import asyncio
+from collections import OrderedDict
+
+import metrics
+
+cache_events = metrics.counter(
+    "mathy_response_cache_total", "Reply cache lookups (hit, miss, coalesced) and evictions", ["event"]
+)
+
+class ResponseCache:
+    """LRU cache with per-entry TTL that also coalesces identical in-flight requests.
+
+    While a key is being fetched, later callers for the same key await the
+    same upstream call instead of starting their own. Only successful results
+    are stored; failures reach every waiter but are never cached.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 900):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}            # key -> future shared by all waiters
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """Returns the cached value (refreshing its LRU position) or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            cache_events.inc(event="eviction")
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        cache_events.inc(event="hit")
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            cache_events.inc(event="eviction")
+
+    def has(self, key):
+        """Whether `key` can be answered without a new fetch (fresh entry or in flight); counts nothing."""
+        entry = self._entries.get(key)
+        return key in self._inflight or (entry is not None and entry[0] > time.monotonic())
+
+    def pending(self, key):
+        """Returns the future of an in-flight fetch for `key`, if there is one."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            cache_events.inc(event="coalesced")
+        return future
+
+    def track(self, key, future):
+        """Registers `future` as the in-flight fetch for `key`; its result is cached on success."""
+        self.misses += 1
+        cache_events.inc(event="miss")
+        self._inflight[key] = future
+        future.add_done_callback(lambda done: self._settle(key, done))
+        return future
+
+    async def get_or_fetch(self, key, fetch):
+        """Returns the cached value for `key`, awaiting `fetch()` at most once across concurrent callers."""
+        value = self.lookup(key)
+        if value is not None:
+            return value
+        future = self.pending(key)
+        if future is None:
+            # Run the fetch as its own task so a cancelled caller does not cancel it for the others
+            future = self.track(key, asyncio.ensure_future(fetch()))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            # The request we joined was abandoned by its owner; fetch on our own
+            return await fetch()
+
+    def _settle(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
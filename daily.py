@@ -1,16 +1,18 @@
 # daily.py
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import re
+import asyncio
+import logging
 from ai import get_mathy_response
+from gemini import generate
+import database
 import random
-import asyncio
-
-load_dotenv()
+from dedup import problem_index, check_unique, signature
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger()
 
-model = genai.GenerativeModel("gemini-2.5-flash")
+BUFFER_SIZE = int(os.getenv("DAILY_BUFFER_SIZE", "3"))  # days of problems kept ready
+LETTER_TO_EMOJI = {'A': '🇦', 'B': '🇧', 'C': '🇨', 'D': '🇩'}
 
 async def math_problem():
     prompt = """Your job:
@@ -41,8 +43,7 @@ Main Rule:
 – Be completely related to math, even on the things that are not related.
 """
     try:
-        response = model.generate_content(prompt)
-        response_text = response.text
+        response_text = await generate(prompt)
         start_marker = "📘 **Daily Math Challenge**"
         start_index = response_text.find(start_marker)
         if start_index != -1:
@@ -51,6 +52,76 @@ Main Rule:
     except Exception as e:
         return f"❌ Error generating math problem: {str(e)}"
 
+def parse_problem(text: str):
+    """Splits a generated problem into (problem_text, answer_letter, answer_emoji)."""
+    match = re.search(r"Correct Answer:\s*([A-D])", text, re.IGNORECASE)
+    if match:
+        letter = match.group(1).upper()
+        text = re.sub(r"Correct Answer:\s*[A-D]\s*", "", text, flags=re.IGNORECASE).strip()
+    else:
+        letter = None
+
+    # scrub stray checkmarks if model adds them
+    text = text.replace("\u2714", "")
+    return text, letter, LETTER_TO_EMOJI.get(letter)
+
+def is_valid_problem(problem: str, letter) -> bool:
+    """A problem is postable if it parsed an answer and fits one message with the role ping."""
+    return bool(letter) and not problem.startswith("❌") and "Daily Math Challenge" in problem and len(problem) <= 1900
+
+async def generate_problem(attempts: int = 3):
+    """Generates and parses a problem, retrying until it validates and isn't a repeat.
+
+    Returns (problem, letter, emoji, signature), or None if no attempt passes.
+    """
+    for attempt in range(1, attempts + 1):
+        problem, letter, emoji = parse_problem(await math_problem())
+        if not is_valid_problem(problem, letter):
+            logger.warning(f"⚠️ Generated problem failed validation (attempt {attempt}/{attempts})")
+            continue
+        sig = check_unique(problem)
+        if sig is not None:
+            return problem, letter, emoji, sig
+    return None
+
+_refill_lock = asyncio.Lock()
+
+async def fill_problem_buffer(target: int = BUFFER_SIZE):
+    """Tops the daily_problem_buffer table up to `target` validated problems."""
+    if _refill_lock.locked():
+        return
+    async with _refill_lock:
+        try:
+            missing = target - await database.count_buffered_problems()
+            for _ in range(missing):
+                generated = await generate_problem()
+                if generated is None:
+                    break
+                problem, letter, emoji, sig = generated
+                await database.buffer_daily_problem(problem, letter, emoji, list(sig))
+                problem_index.add(sig, "buffered")
+            if missing > 0:
+                logger.info(f"📦 Daily problem buffer refilled ({missing} requested).")
+        except Exception as e:
+            logger.error(f"❌ Failed to refill daily problem buffer: {e}")
+
+async def take_daily_problem():
+    """Returns (problem, letter, emoji, signature) for today: from the buffer if possible, else generated live."""
+    try:
+        row = await database.pop_buffered_problem()
+    except Exception as e:
+        logger.error(f"❌ Could not read daily problem buffer: {e}")
+        row = None
+    if row:
+        problem = row["problem_text"]
+        return problem, row["correct_answer_letter"], row["correct_answer_option"], tuple(row["signature"] or signature(problem))
+    logger.warning("⚠️ Daily problem buffer empty, generating live.")
+    generated = await generate_problem()
+    if generated is not None:
+        return generated
+    problem, letter, emoji = parse_problem(await math_problem())  # post something rather than nothing
+    return problem, letter, emoji, signature(problem)
+
 prompt_type=["Listening to", "Playing", "Watching"]
 choice=random.choice(prompt_type)
 QUOTE_PROMPT = f"""
@@ -62,19 +133,101 @@ async def math_quote():
     print(f"🧠 Daily Quote: {response.strip()}")
     return response.strip(), choice
 
+VOTE_EMOJIS = ['🇦', '🇧', '🇨', '🇩']
+
+class VoteTally:
+    """Who voted what on the active daily problem, kept current from raw reaction events.
+
+    A user's vote is the last option they reacted with; older reactions of the
+    same user are removed by the bot and stop counting immediately.
+    """
+
+    def __init__(self, message_id=None):
+        self.message_id = message_id
+        self.reactions = {}  # user_id -> vote emojis the user has on the message, oldest first
+
+    def reset(self, message_id):
+        self.message_id = message_id
+        self.reactions = {}
+
+    def add(self, user_id: int, emoji: str):
+        """Records a reaction and returns the user's other vote emojis (to be removed)."""
+        held = self.reactions.setdefault(user_id, [])
+        if emoji in held:
+            held.remove(emoji)
+        held.append(emoji)
+        return held[:-1]
+
+    def remove(self, user_id: int, emoji: str):
+        held = self.reactions.get(user_id)
+        if held and emoji in held:
+            held.remove(emoji)
+            if not held:
+                del self.reactions[user_id]
+
+    def vote_of(self, user_id: int):
+        held = self.reactions.get(user_id)
+        return held[-1] if held else None
+
+    def counts(self):
+        """Votes per option, options nobody picked left out (so no votes gives {})."""
+        counts = {emoji: 0 for emoji in VOTE_EMOJIS}
+        for held in self.reactions.values():
+            counts[held[-1]] += 1
+        return {emoji: count for emoji, count in counts.items() if count}
+
+    async def reconcile(self, message, bot_user_id: int):
+        """Rebuilds the tally from the message's reactions (one pass of API calls, at startup)."""
+        self.reset(message.id)
+        for reaction in message.reactions:
+            emoji = str(reaction.emoji)
+            if emoji not in VOTE_EMOJIS:
+                continue
+            async for user in reaction.users():
+                if user.id != bot_user_id:
+                    self.add(user.id, emoji)
+
+class VoteBoard:
+    """One VoteTally per posted copy of today's problem (one per guild), by message ID."""
+
+    def __init__(self):
+        self.tallies = {}  # message_id -> VoteTally
+
+    def reset(self, message_ids=()):
+        self.tallies = {message_id: VoteTally(message_id) for message_id in message_ids}
+
+    def track(self, message_id):
+        return self.tallies.setdefault(message_id, VoteTally(message_id))
+
+    def get(self, message_id):
+        return self.tallies.get(message_id)
+
+    def counts(self):
+        """Votes summed over every guild, in VOTE_EMOJIS order; like VoteTally.counts, zeros are left out."""
+        counts = {emoji: 0 for emoji in VOTE_EMOJIS}
+        for tally in self.tallies.values():
+            for emoji, count in tally.counts().items():
+                counts[emoji] += count
+        return {emoji: count for emoji, count in counts.items() if count}
+
+vote_board = VoteBoard()
+
 async def get_vote_counts(message):
     counts = {}
     if message is None:
         return counts
 
+    # The live tally is free; only fall back to the API for some other message
+    tally = vote_board.get(message.id)
+    if tally is not None:
+        return tally.counts()
+
     # Fetch the message fresh from Discord to get updated reactions
     channel = message.channel
     fresh_message = await channel.fetch_message(message.id)
 
     for reaction in fresh_message.reactions:
-        if reaction.emoji in ['🇦', '🇧', '🇨', '🇩']:
+        if reaction.emoji in VOTE_EMOJIS and reaction.count > 1:
             counts[reaction.emoji] = reaction.count - 1  # subtract bot's own reaction
 
     return counts
-
-
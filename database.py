@@ -1,21 +1,167 @@
 # database.py
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import re
+import gzip
+import json
+import shutil
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
 from dotenv import load_dotenv
 
+import metrics
+import tracing
+
 load_dotenv()
 
+logger = logging.getLogger()
+
 DATABASE_URL = os.getenv("DATABASE_URL")
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+# Connections idle longer than this are pinged before reuse
+HEALTH_CHECK_AFTER = float(os.getenv("DB_HEALTH_CHECK_AFTER", "30"))
+
+# Write-behind settings for mathy_logs
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))          # rows per INSERT
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "5"))   # max seconds a row waits
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "5000"))            # rows buffered in memory
+LOG_SPILL_FILE = os.getenv("LOG_SPILL_FILE", "logs/mathy_logs_spill.jsonl")
+LOG_REPLAY_FILE = LOG_SPILL_FILE + ".replaying"                    # spilled rows being written back
+
+# mathy_logs is partitioned by month; old months are dropped (archived first if LOG_ARCHIVE_DIR is set)
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "12"))  # full months kept before the current one
+LOG_PARTITIONS_AHEAD = 2                                             # future months created in advance
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "")
+LOG_QUERY_TIMEOUT_MS = int(os.getenv("LOG_QUERY_TIMEOUT_MS", "2000"))  # cap on history/activity queries
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}  # id(conn) -> time.monotonic() when it went back to the pool
+
+# One worker per pooled connection, so the pool is never exhausted
+_executor = ThreadPoolExecutor(max_workers=POOL_MAX, thread_name_prefix="mathy-db")
+
+db_latency = metrics.histogram("mathy_db_seconds", "DB call latency, pool wait included", labelnames=["op"])
+db_errors = metrics.counter("mathy_db_errors_total", "DB calls that raised", ["op"])
+
+# === Connection pool ===
+psycopg2 = None  # imported with the first connection (see _driver), off the startup path
+
+def _driver():
+    global psycopg2
+    if psycopg2 is None:
+        import psycopg2.extras
+        import psycopg2.pool
+    return psycopg2
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                driver = _driver()  # before anything can raise: except clauses below name psycopg2
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL is not set in environment.")
+                # Railway typically requires SSL; keep RealDictCursor for dict-like rows
+                _pool = driver.pool.ThreadedConnectionPool(
+                    POOL_MIN, POOL_MAX, DATABASE_URL,
+                    sslmode="require", cursor_factory=driver.extras.RealDictCursor
+                )
+                logger.info(f"🗄️ DB pool ready ({POOL_MIN}-{POOL_MAX} connections).")
+    return _pool
+
+def _is_healthy(conn):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout():
+    """Takes a connection from the pool, replacing it if it is closed or fails a health check."""
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    returned_at = _last_used.pop(id(conn), None)
+    stale = returned_at is not None and time.monotonic() - returned_at > HEALTH_CHECK_AFTER
+    if conn.closed or (stale and not _is_healthy(conn)):
+        logger.warning("🔌 Dropping dead DB connection, reconnecting...")
+        db_pool.putconn(conn, close=True)
+        conn = db_pool.getconn()
+    return conn
+
+def _checkin(conn, broken=False):
+    close = broken or bool(conn.closed)
+    if not close:
+        _last_used[id(conn)] = time.monotonic()
+    get_pool().putconn(conn, close=close)
+
+@contextmanager
+def connection():
+    """Yields a pooled connection; commits on success, rolls back on error."""
+    conn = _checkout()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _checkin(conn, broken)
 
 def get_connection():
+    """Opens a standalone (unpooled) connection, e.g. for one-off scripts."""
+    driver = _driver()
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL is not set in environment.")
-    # Railway typically requires SSL; keep RealDictCursor for dict-like rows
-    return psycopg2.connect(DATABASE_URL, sslmode="require", cursor_factory=RealDictCursor)
+    return driver.connect(DATABASE_URL, sslmode="require", cursor_factory=driver.extras.RealDictCursor)
+
+def _with_retry(fn, *args):
+    """Runs fn(conn, *args) in a transaction, retrying once on a fresh connection if the link dropped."""
+    for attempt in (1, 2):
+        try:
+            with connection() as conn:
+                return fn(conn, *args)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == 2:
+                raise
+            logger.warning(f"🔁 DB connection lost ({e}), retrying...")
+
+async def _run(fn, *args):
+    """Runs a blocking DB function on the DB thread pool so the event loop keeps going."""
+    loop = asyncio.get_running_loop()
+    op = fn.__name__.lstrip("_")
+    started = time.perf_counter()
+    try:
+        with tracing.span(f"db.{op}"):
+            return await loop.run_in_executor(_executor, _with_retry, fn, *args)
+    except Exception:
+        db_errors.inc(op=op)
+        raise
+    finally:
+        db_latency.observe(time.perf_counter() - started, op=op)
 
-def init_db():
-    conn = get_connection()
+def close():
+    """Closes every pooled connection (call on shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+# === Queries ===
+def _init_db(conn):
     cur = conn.cursor()
 
     cur.execute("""
@@ -40,47 +186,532 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """)
+    # {guild_id: [channel_id, message_id]} for every server the problem went to
+    cur.execute("ALTER TABLE daily_problems ADD COLUMN IF NOT EXISTS guild_messages JSONB NOT NULL DEFAULT '{}'::jsonb")
+    # MinHash signature of the problem text (see dedup.py)
+    cur.execute("ALTER TABLE daily_problems ADD COLUMN IF NOT EXISTS signature BIGINT[]")
 
-    conn.commit()
-    conn.close()
+    # Where each server wants the daily problem; disabled rows are kept so they aren't re-seeded
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS guild_config (
+        guild_id BIGINT PRIMARY KEY,
+        channel_id BIGINT NOT NULL,
+        role_id BIGINT,
+        enabled BOOLEAN NOT NULL DEFAULT TRUE,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
 
-def save_daily_problem(date, problem_text, letter, option, message_id):
-    conn = get_connection()
+    # Last completed slot of each scheduler job, for catch-up after restarts
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+        name TEXT PRIMARY KEY,
+        last_run TIMESTAMPTZ NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+    # Problems generated ahead of time, posted oldest first at midnight
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_problem_buffer (
+        id SERIAL PRIMARY KEY,
+        problem_text TEXT NOT NULL,
+        correct_answer_letter CHAR(1) NOT NULL,
+        correct_answer_option TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cur.execute("ALTER TABLE daily_problem_buffer ADD COLUMN IF NOT EXISTS signature BIGINT[]")
+
+    _migrate(cur)
+
+def _save_daily_problem(conn, date, problem_text, letter, option, message_id, signature):
     cur = conn.cursor()
     cur.execute("""
-        INSERT INTO daily_problems (date, problem_text, correct_answer_letter, correct_answer_option, message_id)
-        VALUES (%s, %s, %s, %s, %s)
+        INSERT INTO daily_problems (date, problem_text, correct_answer_letter, correct_answer_option, message_id, signature)
+        VALUES (%s, %s, %s, %s, %s, %s)
         ON CONFLICT (date) DO UPDATE
         SET problem_text = EXCLUDED.problem_text,
             correct_answer_letter = EXCLUDED.correct_answer_letter,
             correct_answer_option = EXCLUDED.correct_answer_option,
-            message_id = EXCLUDED.message_id
-    """, (date, problem_text, letter, option, message_id))
-    conn.commit()
-    conn.close()
+            message_id = EXCLUDED.message_id,
+            signature = EXCLUDED.signature
+    """, (date, problem_text, letter, option, message_id, signature))
+
+def _add_guild_messages(conn, date, messages):
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE daily_problems SET guild_messages = guild_messages || %s::jsonb WHERE date = %s",
+        (json.dumps({str(guild_id): ids for guild_id, ids in messages.items()}), date)
+    )
 
-def get_latest_daily_problem():
-    conn = get_connection()
+def _get_latest_daily_problem(conn):
     cur = conn.cursor()
     cur.execute("SELECT problem_text FROM daily_problems ORDER BY created_at DESC LIMIT 1")
     row = cur.fetchone()
-    conn.close()
     return row["problem_text"] if row else None
 
-def load_today_problem(date):
-    conn = get_connection()
+def _load_today_problem(conn, date):
     cur = conn.cursor()
     cur.execute("SELECT * FROM daily_problems WHERE date = %s", (date,))
-    result = cur.fetchone()
-    conn.close()
-    return result
+    return cur.fetchone()
+
+def _buffer_daily_problem(conn, problem_text, letter, option, signature):
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO daily_problem_buffer (problem_text, correct_answer_letter, correct_answer_option, signature) VALUES (%s, %s, %s, %s)",
+        (problem_text, letter, option, signature)
+    )
+
+def _pop_buffered_problem(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM daily_problem_buffer
+        WHERE id = (
+            SELECT id FROM daily_problem_buffer ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+        )
+        RETURNING problem_text, correct_answer_letter, correct_answer_option, signature
+    """)
+    return cur.fetchone()
+
+def _count_buffered_problems(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) AS n FROM daily_problem_buffer")
+    return cur.fetchone()["n"]
+
+def _load_problem_signatures(conn):
+    # Text is only needed (and only sent) for rows from before signatures were stored
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT 'daily' AS source, id, date, signature,
+               CASE WHEN signature IS NULL THEN problem_text END AS problem_text
+        FROM daily_problems
+        UNION ALL
+        SELECT 'buffer' AS source, id, NULL AS date, signature,
+               CASE WHEN signature IS NULL THEN problem_text END AS problem_text
+        FROM daily_problem_buffer
+    """)
+    return cur.fetchall()
 
-def log_mathy_interaction(user_id, username, question, response):
-    conn = get_connection()
+def _save_problem_signatures(conn, rows):
+    cur = conn.cursor()
+    tables = {"daily": "daily_problems", "buffer": "daily_problem_buffer"}
+    for source, row_id, signature in rows:
+        cur.execute(f"UPDATE {tables[source]} SET signature = %s WHERE id = %s", (signature, row_id))
+
+def _load_guild_configs(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT guild_id, channel_id, role_id FROM guild_config WHERE enabled")
+    return cur.fetchall()
+
+def _save_guild_config(conn, guild_id, channel_id, role_id):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO guild_config (guild_id, channel_id, role_id) VALUES (%s, %s, %s)
+        ON CONFLICT (guild_id) DO UPDATE
+        SET channel_id = EXCLUDED.channel_id,
+            role_id = EXCLUDED.role_id,
+            enabled = TRUE,
+            updated_at = CURRENT_TIMESTAMP
+    """, (guild_id, channel_id, role_id))
+
+def _seed_guild_config(conn, guild_id, channel_id, role_id):
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO mathy_logs (user_id, username, question, response) VALUES (%s, %s, %s, %s)",
-        (user_id, username, question, response)
+        "INSERT INTO guild_config (guild_id, channel_id, role_id) VALUES (%s, %s, %s) ON CONFLICT (guild_id) DO NOTHING",
+        (guild_id, channel_id, role_id)
+    )
+    return cur.rowcount == 1
+
+def _disable_guild_config(conn, guild_id):
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE guild_config SET enabled = FALSE, updated_at = CURRENT_TIMESTAMP WHERE guild_id = %s",
+        (guild_id,)
+    )
+
+def _load_job_runs(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT name, last_run FROM scheduled_jobs")
+    return {row["name"]: row["last_run"] for row in cur.fetchall()}
+
+def _record_job_run(conn, name, slot):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO scheduled_jobs (name, last_run) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET last_run = GREATEST(scheduled_jobs.last_run, EXCLUDED.last_run),
+            updated_at = CURRENT_TIMESTAMP
+    """, (name, slot))
+
+def _insert_mathy_logs(conn, rows):
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO mathy_logs (user_id, username, question, response, timestamp) VALUES %s",
+        rows,
+        page_size=LOG_BATCH_SIZE
     )
-    conn.commit()
-    conn.close()
+
+# === Migrations ===
+# Schema changes that aren't a plain CREATE/ADD ... IF NOT EXISTS run once each, in order,
+# and are recorded in schema_migrations. Never edit an applied one; append a new one.
+def _month_start(day, offset=0):
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+def _partition_name(month):
+    return f"mathy_logs_{month:%Y_%m}"
+
+def _create_log_partition(cur, month):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF mathy_logs
+        FOR VALUES FROM ('{month}') TO ('{_month_start(month, 1)}')
+    """)
+
+def _partition_mathy_logs(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'mathy_logs'::regclass")
+    if cur.fetchone()["relkind"] == "p":
+        return
+    cur.execute("ALTER TABLE mathy_logs RENAME TO mathy_logs_legacy")
+    cur.execute("ALTER SEQUENCE mathy_logs_id_seq OWNED BY NONE")
+    cur.execute("""
+    CREATE TABLE mathy_logs (
+        id BIGINT NOT NULL DEFAULT nextval('mathy_logs_id_seq'),
+        user_id BIGINT,
+        username TEXT,
+        question TEXT,
+        response TEXT,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    """)
+    cur.execute("ALTER SEQUENCE mathy_logs_id_seq OWNED BY mathy_logs.id")
+    # Rows outside every monthly range land here instead of failing the insert
+    cur.execute("CREATE TABLE mathy_logs_default PARTITION OF mathy_logs DEFAULT")
+
+    cur.execute("SELECT MIN(timestamp) AS first FROM mathy_logs_legacy")
+    first = cur.fetchone()["first"]
+    today = _utcnow().date()
+    month = _month_start(first.date() if first else today, 0)
+    while month <= _month_start(today, LOG_PARTITIONS_AHEAD):
+        _create_log_partition(cur, month)
+        month = _month_start(month, 1)
+    cur.execute("""
+        INSERT INTO mathy_logs (id, user_id, username, question, response, timestamp)
+        SELECT id, user_id, username, question, response, COALESCE(timestamp, CURRENT_TIMESTAMP)
+        FROM mathy_logs_legacy
+    """)
+    cur.execute("DROP TABLE mathy_logs_legacy")
+
+def _index_mathy_logs(cur):
+    # Per-user history reads the newest rows first; BRIN keeps time-range scans cheap on append-only data
+    cur.execute("CREATE INDEX IF NOT EXISTS mathy_logs_user_time ON mathy_logs (user_id, timestamp DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS mathy_logs_time_brin ON mathy_logs USING BRIN (timestamp)")
+
+MIGRATIONS = [
+    (1, "partition mathy_logs by month", _partition_mathy_logs),
+    (2, "index mathy_logs by user and time", _index_mathy_logs),
+]
+
+def _migrate(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    # Two bot processes overlapping during a deploy must not migrate at the same time
+    cur.execute("SELECT pg_advisory_xact_lock(7311)")
+    cur.execute("SELECT version FROM schema_migrations")
+    applied = {row["version"] for row in cur.fetchall()}
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"🧱 Applying migration {version}: {name}")
+        migrate(cur)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+
+# === mathy_logs partitions and queries ===
+def _log_partitions(cur):
+    """{month start: partition name} for the monthly partitions that exist."""
+    cur.execute("""
+        SELECT child.relname AS name FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'mathy_logs'::regclass
+    """)
+    partitions = {}
+    for row in cur.fetchall():
+        match = re.fullmatch(r"mathy_logs_(\d{4})_(\d{2})", row["name"])
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = row["name"]
+    return partitions
+
+def _archive_partition(cur, name):
+    os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(LOG_ARCHIVE_DIR, f"{name}.csv.gz")
+    with gzip.open(path, "wb") as f:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", f)
+    return path
+
+def _maintain_log_partitions(conn):
+    """Creates the coming months' partitions and drops those past LOG_RETENTION_MONTHS."""
+    cur = conn.cursor()
+    today = _utcnow().date()
+    partitions = _log_partitions(cur)
+    created, dropped = [], []
+    for offset in range(LOG_PARTITIONS_AHEAD + 1):
+        month = _month_start(today, offset)
+        if month not in partitions:
+            _create_log_partition(cur, month)
+            created.append(_partition_name(month))
+    cutoff = _month_start(today, -LOG_RETENTION_MONTHS)
+    for month, name in sorted(partitions.items()):
+        if month >= cutoff:
+            continue
+        if LOG_ARCHIVE_DIR:
+            logger.info(f"📦 Archived {name} to {_archive_partition(cur, name)}")
+        cur.execute(f"ALTER TABLE mathy_logs DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return created, dropped
+
+def _recent_user_logs(conn, user_id, limit):
+    cur = conn.cursor()
+    cur.execute(f"SET LOCAL statement_timeout = {LOG_QUERY_TIMEOUT_MS}")
+    cur.execute("""
+        SELECT username, question, response, timestamp FROM mathy_logs
+        WHERE user_id = %s ORDER BY timestamp DESC LIMIT %s
+    """, (user_id, limit))
+    return cur.fetchall()
+
+def _log_activity(conn, start, end, limit):
+    cur = conn.cursor()
+    cur.execute(f"SET LOCAL statement_timeout = {LOG_QUERY_TIMEOUT_MS}")
+    cur.execute("""
+        SELECT user_id, MAX(username) AS username, COUNT(*) AS interactions, MAX(timestamp) AS last_seen
+        FROM mathy_logs WHERE timestamp >= %s AND timestamp < %s
+        GROUP BY user_id ORDER BY interactions DESC LIMIT %s
+    """, (start, end, limit))
+    return cur.fetchall()
+
+# === Async API (runs on the DB thread pool) ===
+def _ping(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    cur.close()
+
+async def ping():
+    """Raises if the database can't be reached."""
+    await _run(_ping)
+
+async def init_db():
+    await _run(_init_db)
+
+async def save_daily_problem(date, problem_text, letter, option, message_id, signature=None):
+    await _run(_save_daily_problem, date, problem_text, letter, option, message_id, signature)
+
+async def add_guild_messages(date, messages):
+    """Merges {guild_id: (channel_id, message_id)} into the day's guild_messages."""
+    await _run(_add_guild_messages, date, messages)
+
+async def get_latest_daily_problem():
+    return await _run(_get_latest_daily_problem)
+
+async def load_today_problem(date):
+    return await _run(_load_today_problem, date)
+
+async def buffer_daily_problem(problem_text, letter, option, signature=None):
+    await _run(_buffer_daily_problem, problem_text, letter, option, signature)
+
+async def pop_buffered_problem():
+    """Removes and returns the oldest pre-generated problem, or None if the buffer is empty."""
+    return await _run(_pop_buffered_problem)
+
+async def count_buffered_problems():
+    return await _run(_count_buffered_problems)
+
+async def load_problem_signatures():
+    """(source, id, date, signature, problem_text if unsigned) for every posted and buffered problem."""
+    return await _run(_load_problem_signatures)
+
+async def save_problem_signatures(rows):
+    """Stores signatures given as (source, id, signature) rows."""
+    await _run(_save_problem_signatures, rows)
+
+async def load_guild_configs():
+    """Rows (guild_id, channel_id, role_id) of every guild subscribed to the daily problem."""
+    return await _run(_load_guild_configs)
+
+async def save_guild_config(guild_id, channel_id, role_id):
+    await _run(_save_guild_config, guild_id, channel_id, role_id)
+
+async def seed_guild_config(guild_id, channel_id, role_id):
+    """Adds a config only if the guild has none; returns True if it was added."""
+    return await _run(_seed_guild_config, guild_id, channel_id, role_id)
+
+async def disable_guild_config(guild_id):
+    await _run(_disable_guild_config, guild_id)
+
+async def load_job_runs():
+    """Returns {job name: last completed slot} for the scheduler."""
+    return await _run(_load_job_runs)
+
+async def record_job_run(name, slot):
+    await _run(_record_job_run, name, slot)
+
+async def maintain_log_partitions():
+    """Returns ([partitions created], [partitions dropped])."""
+    return await _run(_maintain_log_partitions)
+
+async def recent_user_logs(user_id, limit=10):
+    """The user's last `limit` interactions, newest first (an index scan per month partition)."""
+    return await _run(_recent_user_logs, user_id, limit)
+
+async def log_activity(start, end, limit=20):
+    """Most active users between two naive UTC datetimes: user_id, username, interactions, last_seen."""
+    return await _run(_log_activity, start, end, limit)
+
+async def log_mathy_interaction(user_id, username, question, response):
+    """Queues a mathy_logs row; it is written in a later batch, never inline."""
+    with tracing.span("db.log_enqueue"):
+        enqueue_log((user_id, username, question, response, _utcnow()))
+
+# === Write-behind log queue ===
+_log_queue = None
+_log_task = None
+_spill_lock = threading.Lock()
+_replay_lock = threading.Lock()
+log_stats = {"queued": 0, "written": 0, "batches": 0, "spilled": 0, "replayed": 0}
+
+def _utcnow():
+    # Same clock as the column's CURRENT_TIMESTAMP default on a UTC server
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def enqueue_log(row):
+    """Buffers one row for the writer; spills straight to disk when the buffer is full."""
+    global _log_queue, _log_task
+    if _log_queue is None:
+        _log_queue = asyncio.Queue(maxsize=LOG_QUEUE_MAX)
+    if _log_task is None or _log_task.done():
+        _log_task = asyncio.create_task(_log_writer())
+    try:
+        _log_queue.put_nowait(row)
+        log_stats["queued"] += 1
+    except asyncio.QueueFull:
+        # Backpressure: never make a reply wait on the database
+        _spill([row])
+
+def _spill(rows):
+    with _spill_lock:
+        os.makedirs(os.path.dirname(LOG_SPILL_FILE) or ".", exist_ok=True)
+        with open(LOG_SPILL_FILE, "a", encoding="utf-8") as f:
+            for user_id, username, question, response, ts in rows:
+                f.write(json.dumps([user_id, username, question, response, ts.isoformat()]) + "\n")
+    log_stats["spilled"] += len(rows)
+    logger.warning(f"💾 Spilled {len(rows)} log rows to {LOG_SPILL_FILE}")
+
+def _claim_spill():
+    """Moves spilled rows into LOG_REPLAY_FILE (new spills start a fresh file) and returns every row there."""
+    with _spill_lock:
+        if os.path.exists(LOG_SPILL_FILE):
+            # Append rather than rename: a replay that failed earlier may have left rows behind
+            with open(LOG_SPILL_FILE, "r", encoding="utf-8") as src, open(LOG_REPLAY_FILE, "a", encoding="utf-8") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(LOG_SPILL_FILE)
+    if not os.path.exists(LOG_REPLAY_FILE):
+        return []
+    with open(LOG_REPLAY_FILE, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(u, n, q, r, datetime.fromisoformat(ts)) for u, n, q, r, ts in rows]
+
+def _replay_spill():
+    """Inserts rows spilled while the DB was down; the file goes only once they are committed."""
+    if not _replay_lock.acquire(blocking=False):
+        return 0  # another batch is already replaying
+    try:
+        rows = _claim_spill()
+        if rows:
+            _with_retry(_insert_mathy_logs, rows)
+        if os.path.exists(LOG_REPLAY_FILE):
+            os.remove(LOG_REPLAY_FILE)
+    finally:
+        _replay_lock.release()
+    log_stats["replayed"] += len(rows)
+    if rows:
+        logger.info(f"♻️ Replayed {len(rows)} spilled log rows.")
+    return len(rows)
+
+def _write_batch(rows):
+    """Writes one batch (plus any spilled backlog); on failure the batch goes to the spill file."""
+    try:
+        def write(conn):
+            _insert_mathy_logs(conn, rows)
+        with metrics.timer(db_latency, op="write_logs"):
+            _with_retry(write)
+        log_stats["written"] += len(rows)
+        log_stats["batches"] += 1
+    except Exception as e:
+        db_errors.inc(op="write_logs")
+        logger.error(f"❌ Failed to write {len(rows)} log rows: {e}")
+        _spill(rows)
+        return
+    if os.path.exists(LOG_SPILL_FILE) or os.path.exists(LOG_REPLAY_FILE):
+        try:
+            _replay_spill()
+        except Exception as e:
+            logger.error(f"❌ Failed to replay spilled log rows: {e}")
+
+async def _log_writer():
+    """Flushes queued rows every LOG_BATCH_SIZE rows or LOG_FLUSH_INTERVAL seconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = []
+        try:
+            batch.append(await _log_queue.get())
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_log_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Stopping mid-collection: don't lose the rows already taken off the queue
+            if batch:
+                await loop.run_in_executor(_executor, _write_batch, batch)
+            raise
+
+        write = loop.run_in_executor(_executor, _write_batch, batch)
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            await write  # let the batch in progress finish before stopping
+            raise
+
+async def flush_logs():
+    """Stops the writer and writes everything still queued (call before shutdown/restart)."""
+    global _log_task
+    if _log_task is not None:
+        _log_task.cancel()
+        try:
+            await _log_task
+        except asyncio.CancelledError:
+            pass
+        _log_task = None
+    rows = []
+    while _log_queue is not None and not _log_queue.empty():
+        rows.append(_log_queue.get_nowait())
+    loop = asyncio.get_running_loop()
+    for i in range(0, len(rows), LOG_BATCH_SIZE):
+        await loop.run_in_executor(_executor, _write_batch, rows[i:i + LOG_BATCH_SIZE])
+    if rows:
+        logger.info(f"🧾 Flushed {len(rows)} queued log rows.")
+
+async def shutdown():
+    """Flushes the log queue and closes the pool."""
+    await flush_logs()
+    await asyncio.get_running_loop().run_in_executor(_executor, close)
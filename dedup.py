@@ -0,0 +1,107 @@
+# dedup.py
+import os
+import re
+import random
+import hashlib
+import logging
+
+import database
+import metrics
+
+logger = logging.getLogger()
+
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.4"))  # estimated similarity that counts as a repeat
+SHINGLE = 5          # characters per shingle
+BANDS, ROWS = 30, 2  # LSH: 60 hashes; pairs above 0.4 similarity share a band >99% of the time
+NUM_PERM = BANDS * ROWS
+_PRIME = (1 << 61) - 1
+
+# Fixed seed: signatures are stored in the DB and must match across restarts
+_rng = random.Random(1729)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+dedup_checks = metrics.counter("mathy_dedup_total", "Generated daily problems checked against history", ["result"])
+
+def normalize(text: str) -> str:
+    """Lowercase words and numbers only: formatting, emojis and the header don't make problems different."""
+    text = text.replace("Daily Math Challenge", "")
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+def signature(text: str):
+    """MinHash of the text's character shingles, NUM_PERM ints (each fits a BIGINT)."""
+    text = normalize(text)
+    shingles = {text[i:i + SHINGLE] for i in range(max(len(text) - SHINGLE + 1, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+def similarity(sig_a, sig_b) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+class ProblemIndex:
+    """Near-duplicate lookup over every problem posted or buffered so far.
+
+    Signatures are split into BANDS bands of ROWS hashes; two problems are
+    compared only if some band matches exactly, so a check looks at a handful
+    of candidates instead of the whole history. Entries are added as
+    problems are generated, never rebuilt.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.labels = {}  # signature -> label (date posted, or "buffered")
+        self._bands = {}  # (band, band hashes) -> set of signatures
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _keys(self, sig):
+        return [(band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def add(self, sig, label=None):
+        sig = tuple(sig)
+        known = sig in self.labels
+        self.labels[sig] = label
+        if known:
+            return
+        for key in self._keys(sig):
+            self._bands.setdefault(key, set()).add(sig)
+
+    def nearest(self, sig):
+        """Returns (label, similarity) of the closest indexed problem at or above the threshold, else None."""
+        candidates = set()
+        for key in self._keys(sig):
+            candidates |= self._bands.get(key, set())
+        best = None
+        for other in candidates:
+            score = similarity(sig, other)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (self.labels[other], score)
+        return best
+
+    async def load(self):
+        """Indexes stored signatures, computing and saving any that are missing (older rows)."""
+        rows = await database.load_problem_signatures()
+        missing = []
+        for row in rows:
+            sig = row["signature"]
+            if sig is None:
+                sig = signature(row["problem_text"])
+                missing.append((row["source"], row["id"], list(sig)))
+            self.add(sig, str(row["date"]) if row["date"] else "buffered")
+        if missing:
+            await database.save_problem_signatures(missing)
+        logger.info(f"🧬 Indexed {len(self)} past problems for duplicate checks ({len(missing)} backfilled).")
+
+problem_index = ProblemIndex()
+
+def check_unique(problem: str):
+    """Returns the problem's signature, or None if it is too close to an earlier one."""
+    sig = signature(problem)
+    match = problem_index.nearest(sig)
+    if match is not None:
+        dedup_checks.inc(result="duplicate")
+        logger.warning(f"♻️ Generated problem repeats the one from {match[0]} ({match[1]:.0%} similar)")
+        return None
+    dedup_checks.inc(result="unique")
+    return sig
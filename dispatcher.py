@@ -0,0 +1,164 @@
+# dispatcher.py
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import metrics
+import tracing
+from ratelimit import TokenBucket
+
+logger = logging.getLogger()
+
+USER_RATE = float(os.getenv("MODEL_USER_RATE_PER_MIN", "6")) / 60  # model calls/sec per user
+USER_BURST = int(os.getenv("MODEL_USER_BURST", "3"))                # calls a user may make back to back
+QUEUE_MAX = int(os.getenv("MODEL_QUEUE_MAX", "50"))                 # chat requests waiting for a slot
+MAX_TRACKED_USERS = 10000                                           # per-user buckets kept (LRU)
+
+# Lanes: scheduled jobs (daily problem, vote summary, presence quote) always go before chat
+SYSTEM, CHAT = "system", "chat"
+
+dispatch_wait = metrics.histogram(
+    "mathy_dispatch_wait_seconds", "Time spent queued for a model slot", labelnames=["lane"]
+)
+dispatch_rejected = metrics.counter(
+    "mathy_dispatch_rejected_total", "Model requests turned away (rate = user over budget, queue = too busy)", ["reason"]
+)
+
+class SlowDown(Exception):
+    """Raised instead of calling the model when a user or the queue is over its limit."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason} limit, retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Dispatcher:
+    """Hands out `capacity` model slots, system lane first, then users round-robin.
+
+    Each user has a token bucket (`check`): past USER_BURST quick calls they
+    get one every 1/USER_RATE seconds. Waiting chat requests are queued per
+    user and served one user at a time in rotation, so a user with ten queued
+    prompts can't hold up everyone else. System requests skip the rotation
+    and are never refused. Once `max_queue` chat requests are waiting, new
+    ones raise SlowDown rather than queueing.
+    """
+
+    def __init__(self, capacity, user_rate=USER_RATE, user_burst=USER_BURST, max_queue=QUEUE_MAX):
+        self.capacity = capacity
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+        self.active = 0
+        self._system = deque()         # futures, FIFO
+        self._chat = OrderedDict()     # user_id -> deque of futures; front user is served next
+        self._chat_waiting = 0
+        self._buckets = OrderedDict()  # user_id -> TokenBucket, least recently used first
+
+    def check(self, user_id):
+        """Spends one of the user's tokens, or raises SlowDown if they have none left."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._buckets) > MAX_TRACKED_USERS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        wait = bucket.try_acquire()
+        if wait > 0:
+            dispatch_rejected.inc(reason="rate")
+            raise SlowDown("rate", wait)
+
+    def waiting(self):
+        return len(self._system) + self._chat_waiting
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, lane=CHAT):
+        """Holds one model slot for the duration of the block."""
+        with tracing.span("model.queue"):
+            await self._acquire(user_id, lane)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def try_acquire(self):
+        """Takes a free slot without waiting (never ahead of queued requests); pair with release()."""
+        if self.active < self.capacity and not self.waiting():
+            self.active += 1
+            return True
+        return False
+
+    def release(self):
+        self._release()
+
+    async def _acquire(self, user_id, lane):
+        if self.active < self.capacity and not self.waiting():
+            self.active += 1
+            dispatch_wait.observe(0, lane=lane)
+            return
+        if lane == CHAT and self._chat_waiting >= self.max_queue:
+            dispatch_rejected.inc(reason="queue")
+            raise SlowDown("queue", 5 * self._chat_waiting / max(self.capacity, 1))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if lane == SYSTEM:
+            self._system.append(future)
+        else:
+            self._chat.setdefault(user_id, deque()).append(future)
+            self._chat_waiting += 1
+        started = loop.time()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # the slot was handed to us just as we were cancelled
+            else:
+                self._forget(future, user_id, lane)
+            raise
+        dispatch_wait.observe(loop.time() - started, lane=lane)
+
+    def _forget(self, future, user_id, lane):
+        if lane == SYSTEM:
+            if future in self._system:  # already popped if a release skipped it as cancelled
+                self._system.remove(future)
+            return
+        waiters = self._chat.get(user_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self._chat_waiting -= 1
+            if not waiters:
+                del self._chat[user_id]
+
+    def _next_waiter(self):
+        if self._system:
+            return self._system.popleft()
+        if self._chat:
+            user_id, waiters = self._chat.popitem(last=False)
+            future = waiters.popleft()
+            self._chat_waiting -= 1
+            if waiters:
+                self._chat[user_id] = waiters  # back of the rotation
+            return future
+        return None
+
+    def _release(self):
+        self.active -= 1
+        while self.active < self.capacity:
+            future = self._next_waiter()
+            if future is None:
+                return
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "system_waiting": len(self._system),
+            "chat_waiting": self._chat_waiting,
+            "users_waiting": len(self._chat),
+        }
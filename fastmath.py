@@ -0,0 +1,304 @@
+# fastmath.py
+import os
+import re
+import sys
+import json
+import ast
+import math
+import random
+import asyncio
+import logging
+import operator
+import importlib.util
+
+import metrics
+
+logger = logging.getLogger()
+
+# Optional: derivatives, simplify/expand/factor and solving. Only the worker process imports it.
+SYMPY_AVAILABLE = importlib.util.find_spec("sympy") is not None
+
+FASTPATH_ENABLED = os.getenv("MATHY_FASTPATH", "1") == "1"
+MAX_INPUT_CHARS = 200
+SYMPY_TIMEOUT = float(os.getenv("FASTPATH_SYMPY_TIMEOUT", "2"))          # seconds per query
+SYMPY_MEMORY_MB = int(os.getenv("FASTPATH_SYMPY_MEMORY_MB", "512"))      # address-space cap for the worker
+
+fastpath_results = metrics.counter(
+    "mathy_fastpath_total", "Local fast-path attempts by outcome (hit, miss, timeout, error)", ["result"]
+)
+
+SIGN_OFFS = [
+    "Calculator-core activated, no Gemini needed 😎",
+    "Solved faster than you can say 'skibidi sigma' 🧮",
+    "Mental math? Nah, silicon math 💅",
+    "Easy W, that's a free L for the homework 🔥",
+]
+
+# ---------- Arithmetic (in-process, AST whitelist) ----------
+ARITHMETIC = re.compile(r"^[\d\s.+\-*/^()%×÷⋅x]+$")
+ARITHMETIC_LEADS = re.compile(
+    r"^(?:what(?:'s| is)|whats|calculate|calc|compute|evaluate|eval)\s+", re.IGNORECASE
+)
+# "2025-10-18", "18/10/2025": dates, not subtraction or division
+DATE_LIKE = re.compile(r"^\d{1,4}([-/.])\d{1,2}\1\d{1,4}$")
+MAX_EXPONENT = 1000
+MAX_RESULT_DIGITS = 500
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+def _check_size(value):
+    if isinstance(value, complex):
+        raise ValueError("complex result")  # e.g. (-8)^(1/3): the model explains the real root better
+    if isinstance(value, int) and value.bit_length() > MAX_RESULT_DIGITS * 3.33:
+        raise ValueError("result too large")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("result not finite")
+    return value
+
+def _eval_node(node):
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_eval_node(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        left, right = _eval_node(node.left), _eval_node(node.right)
+        if isinstance(node.op, ast.Pow) and (abs(right) > MAX_EXPONENT or (abs(left) > 1 and abs(right) * math.log10(abs(left)) > MAX_RESULT_DIGITS)):
+            raise ValueError("exponent too large")
+        return _check_size(_BINARY_OPS[type(node.op)](left, right))
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+
+def _format_number(value):
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
+
+def _arithmetic(text):
+    if not ARITHMETIC.match(text) or not re.search(r"\d\s*[+\-*/^%×÷⋅x]\s*[\d(]", text):
+        return None
+    if DATE_LIKE.match(text):
+        return None
+    # "x" counts as times only between numbers, e.g. "12 x 7"
+    expression = re.sub(r"(?<=[\d)])\s*x\s*(?=[\d(])", "*", text)
+    if "x" in expression:
+        return None
+    expression = expression.replace("^", "**").replace("×", "*").replace("⋅", "*").replace("÷", "/")
+    try:
+        value = _eval_node(ast.parse(expression, mode="eval"))
+    except ZeroDivisionError:
+        return f"🧮 `{text.strip()}` → dividing by zero?? The universe said **undefined** 💀"
+    except (SyntaxError, ValueError, TypeError, OverflowError):
+        return None
+    shown = text.strip().replace("*", "⋅")
+    return f"🧮 `{shown} = {_format_number(value)}`\n\n{random.choice(SIGN_OFFS)}"
+
+# ---------- Symbolic (sympy, in a sandboxed worker process) ----------
+SYMBOLIC_PATTERNS = [
+    ("diff", re.compile(r"^(?:(?:find|what(?:'s| is)) (?:the )?)?(?:derivative of|differentiate|d/dx(?: of)?)\s+(.+)$", re.IGNORECASE)),
+    ("simplify", re.compile(r"^simplify\s+(.+)$", re.IGNORECASE)),
+    ("expand", re.compile(r"^expand\s+(.+)$", re.IGNORECASE)),
+    ("factor", re.compile(r"^factori[sz]e\s+(.+)$|^factor\s+(.+)$", re.IGNORECASE)),
+    ("solve", re.compile(r"^solve(?: for x)?:?\s+(.+)$", re.IGNORECASE)),
+]
+SYMBOLIC_NAMES = {"x", "sin", "cos", "tan", "sec", "csc", "cot", "exp", "log", "ln", "sqrt", "pi", "e", "asin", "acos", "atan", "abs"}
+SYMBOLIC_CHARS = re.compile(r"^[\w\s.+\-*/^()=⋅×]+$")
+
+def _limit_memory():
+    try:
+        import resource
+        limit = SYMPY_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # no rlimits on this platform; the timeout still applies
+
+def _sympy_eval(kind, expression):
+    """Runs inside the worker process; returns Mathy-formatted math or None."""
+    import sympy
+    from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
+
+    transformations = standard_transformations + (implicit_multiplication_application,)
+    x = sympy.Symbol("x")
+    names = {"x": x, "ln": sympy.log, "e": sympy.E, "pi": sympy.pi, "abs": sympy.Abs}
+
+    def parse(text):
+        return parse_expr(text.replace("^", "**").replace("⋅", "*").replace("×", "*"),
+                          local_dict=names, transformations=transformations, evaluate=True)
+
+    def show(value):
+        return sympy.sstr(value).replace("**", "^").replace("*", "⋅")
+
+    if kind == "solve":
+        sides = expression.split("=")
+        if len(sides) > 2:
+            return None
+        equation = parse(sides[0]) - (parse(sides[1]) if len(sides) == 2 else 0)
+        if sympy.simplify(equation) == 0:
+            return "true for every x (both sides are the same)"
+        solutions = sympy.solve(equation, x)
+        if not solutions:
+            return "no solutions"
+        return ", ".join(f"x = {show(s)}" for s in solutions)
+    value = parse(expression)
+    if kind == "diff":
+        return f"d/dx [{show(value)}] = {show(sympy.diff(value, x))}"
+    if kind == "simplify":
+        return show(sympy.simplify(value))
+    if kind == "expand":
+        return show(sympy.expand(value))
+    if kind == "factor":
+        return show(sympy.factor(value))
+    return None
+
+def _worker_main():
+    """Worker loop: one JSON [kind, expression] per stdin line, one JSON reply per stdout line."""
+    _limit_memory()
+    for line in sys.stdin:
+        try:
+            kind, expression = json.loads(line)
+            reply = {"result": _sympy_eval(kind, expression)}
+        except MemoryError:
+            reply = {"error": "out of memory"}
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+class SympySandbox:
+    """One worker process for sympy calls; killed and replaced when a call times out.
+
+    The worker runs this file as a script (see `_worker_main`), so it never
+    imports the bot or starts its threads, and it runs under an RLIMIT_AS cap.
+    Queries are handled one at a time.
+    """
+
+    def __init__(self, timeout=SYMPY_TIMEOUT):
+        self.timeout = timeout
+        self.ready = False  # True once the worker has imported sympy
+        self._proc = None
+        self._lock = asyncio.Lock()
+
+    async def _spawn(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--worker",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+    def _reset(self):
+        self.ready = False
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+
+    async def warm_up(self):
+        """Starts the worker and imports sympy in it, so the first real query isn't slow."""
+        if not SYMPY_AVAILABLE or self.ready:
+            return
+        try:
+            await self.run("expand", "x", timeout=60)
+            self.ready = True
+        except Exception as e:
+            logger.warning(f"⚠ Fast-path sympy worker failed to start: {e}")
+
+    async def run(self, kind, expression, timeout=None):
+        timeout = timeout or self.timeout
+        # Waiting behind another query isn't the worker's fault, so this doesn't reset it
+        await asyncio.wait_for(self._lock.acquire(), timeout)
+        try:
+            if self._proc is None or self._proc.returncode is not None:
+                await self._spawn()
+            self._proc.stdin.write((json.dumps([kind, expression]) + "\n").encode())
+            try:
+                await self._proc.stdin.drain()
+                line = await asyncio.wait_for(self._proc.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                self._reset()
+                asyncio.create_task(self.warm_up())  # replace the killed worker in the background
+                raise
+            except asyncio.CancelledError:
+                self._reset()  # its reply would otherwise be read by the next query
+                raise
+            except (OSError, ValueError) as e:
+                self._reset()  # broken pipe or an oversized reply line
+                raise RuntimeError(f"sympy worker failed: {e}") from e
+            if not line:
+                self._reset()
+                raise RuntimeError("sympy worker exited")
+            reply = json.loads(line)
+        finally:
+            self._lock.release()
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def close(self):
+        self._reset()
+
+sandbox = SympySandbox()
+
+def _symbolic_match(text):
+    for kind, pattern in SYMBOLIC_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            expression = next(group for group in match.groups() if group).strip()
+            if not SYMBOLIC_CHARS.match(expression):
+                return None
+            if not set(re.findall(r"[A-Za-z_]+", expression)) <= SYMBOLIC_NAMES:
+                return None  # anything beyond x and common functions goes to the model
+            return kind, expression
+    return None
+
+# ---------- Entry point ----------
+def _clean(prompt):
+    text = " ".join(prompt.split()).strip()
+    text = text.rstrip("?!.")
+    text = re.sub(r"\s*=\s*$", "", text)
+    return ARITHMETIC_LEADS.sub("", text)
+
+async def try_answer(prompt: str):
+    """Returns a Mathy-formatted answer if the prompt is plain computable math, else None."""
+    if not FASTPATH_ENABLED or not prompt or len(prompt) > MAX_INPUT_CHARS:
+        return None
+    text = _clean(prompt)
+
+    answer = _arithmetic(text)
+    if answer is not None:
+        fastpath_results.inc(result="hit")
+        return answer
+
+    # Symbolic queries only once the worker is warm; a cold start would blow the timeout
+    match = _symbolic_match(text) if sandbox.ready else None
+    if match is None:
+        fastpath_results.inc(result="miss")
+        return None
+    kind, expression = match
+    try:
+        result = await sandbox.run(kind, expression)
+    except asyncio.TimeoutError:
+        fastpath_results.inc(result="timeout")
+        logger.info(f"⏱️ Fast path gave up on {kind} after {SYMPY_TIMEOUT:g}s, asking the model")
+        return None
+    except Exception:
+        fastpath_results.inc(result="error")
+        return None
+    if result is None:
+        fastpath_results.inc(result="miss")
+        return None
+    fastpath_results.inc(result="hit")
+    return f"🧮 **{kind.capitalize()}:** `{expression}`\n\n`{result}`\n\n{random.choice(SIGN_OFFS)}"
+
+if __name__ == "__main__" and sys.argv[1:] == ["--worker"]:
+    _worker_main()
@@ -0,0 +1,310 @@
+# gemini.py
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+from dispatcher import Dispatcher, SYSTEM, CHAT
+
+load_dotenv()
+
+logger = logging.getLogger()
+
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Tried in order: the first is the primary, the rest are hedges and fallbacks
+MODEL_CHAIN = [name.strip() for name in os.getenv("GEMINI_MODELS", f"{MODEL_NAME},gemini-2.5-flash-lite").split(",") if name.strip()]
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))  # in-flight Gemini calls
+REQUEST_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))  # seconds per request
+HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))  # hedge once the primary is slower than this
+HEDGE_DEFAULT = float(os.getenv("GEMINI_HEDGE_AFTER", "8"))  # hedge delay until enough latencies are known
+HEDGE_MIN = 1.0             # never hedge sooner than this
+LATENCY_WINDOW = 200        # recent successful calls per model used for the percentile
+LATENCY_MIN_SAMPLES = 20
+BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))  # consecutive failures that open the circuit
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))  # seconds before a trial call
+
+# google.generativeai takes about a second to import, so it is loaded on first use (or by preload())
+genai = None
+_genai_lock = threading.Lock()
+
+def _sdk():
+    """Imports and configures the Gemini SDK once, for every module that generates text."""
+    global genai
+    with _genai_lock:
+        if genai is None:
+            import google.generativeai as sdk
+            sdk.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            genai = sdk
+    return genai
+
+# Callers beyond the cap wait here (without blocking the event loop): system jobs first, then users in turn
+dispatcher = Dispatcher(MAX_CONCURRENCY)
+
+model_latency = metrics.histogram(
+    "mathy_gemini_latency_seconds", "Latency of successful Gemini calls", labelnames=["model"]
+)
+model_requests = metrics.counter(
+    "mathy_gemini_requests_total", "Gemini calls by model and outcome (ok, blocked, error, timeout, cancelled)", ["model", "outcome"]
+)
+model_hedges = metrics.counter("mathy_gemini_hedges_total", "Hedged second requests sent", ["model"])
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive errors; lets one trial call through after `cooldown`."""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.errors = 0
+        self.opened_at = None
+        self.trial = False  # a half-open trial call is in flight
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def success(self):
+        self.errors = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.errors += 1
+        self.trial = False
+        if self.opened_at is not None or self.errors >= self.failures:
+            self.opened_at = time.monotonic()  # (re)open; a failed trial restarts the cooldown
+
+class ModelClient:
+    """One model in the chain, with its recent latencies and circuit breaker."""
+
+    def __init__(self, name):
+        self.name = name
+        self._model = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.breaker = CircuitBreaker()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = _sdk().GenerativeModel(self.name)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def hedge_delay(self) -> float:
+        """Seconds after which a call to this model counts as slow (its latency percentile)."""
+        if len(self.latencies) < LATENCY_MIN_SAMPLES:
+            return HEDGE_DEFAULT
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))
+        return max(HEDGE_MIN, ordered[index])
+
+    def record(self, outcome, elapsed=None):
+        model_requests.inc(model=self.name, outcome=outcome)
+        if outcome == "ok":
+            self.latencies.append(elapsed)
+            model_latency.observe(elapsed, model=self.name)
+            self.breaker.success()
+        elif outcome == "blocked":
+            self.breaker.success()  # the model is up, it just wouldn't answer this prompt
+        elif outcome in ("error", "timeout"):
+            self.breaker.failure()
+            if self.breaker.state == "open":
+                logger.warning(f"⚡ Circuit open for {self.name}, routing to the next model for {self.breaker.cooldown:g}s")
+        else:
+            self.breaker.trial = False  # cancelled: no verdict on the model
+
+    async def generate(self, prompt, timeout):
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(self.model.generate_content_async(prompt), timeout)
+            text = response.text
+        except asyncio.TimeoutError:
+            self.record("timeout")
+            raise TimeoutError(f"{self.name} timed out after {timeout:g}s") from None
+        except asyncio.CancelledError:
+            self.record("cancelled")
+            raise
+        except ValueError:
+            # No text in the response (safety block): another model won't do better
+            self.record("blocked")
+            raise
+        except Exception:
+            self.record("error")
+            raise
+        self.record("ok", time.monotonic() - started)
+        return text
+
+clients = [ModelClient(name) for name in MODEL_CHAIN]
+
+def preload():
+    """Builds every model client now (blocking; run it in a thread while the gateway connects)."""
+    for client in clients:
+        client.model
+
+class Unavailable(Exception):
+    """Every model in the chain has an open circuit."""
+
+def _pick(queue):
+    """Pops the next model from `queue` whose circuit lets a call through."""
+    while queue:
+        client = queue.pop(0)
+        if client.breaker.allow():
+            return client
+    return None
+
+async def generate(prompt: str, timeout: float = None, user_id: str = None) -> str:
+    """Generates text for a prompt using the native async Gemini client.
+
+    At most MAX_CONCURRENCY requests are in flight at once; calls without a
+    `user_id` are system jobs and are served ahead of queued chat. The first
+    model in the chain gets the request. If it hasn't answered within its
+    p95 latency, a hedged request goes to the next model and the first good
+    answer wins; the hedge takes a second dispatcher slot, and is skipped
+    while none is free. A failed call falls through to the next model. Models with
+    an open circuit breaker are skipped. Everything is cancelled after
+    `timeout` seconds (REQUEST_TIMEOUT by default) or if the awaiting task
+    is cancelled.
+    """
+    timeout = REQUEST_TIMEOUT if timeout is None else timeout
+    async with dispatcher.slot(user_id, CHAT if user_id else SYSTEM):
+        deadline = time.monotonic() + timeout
+        queue = list(clients)
+        running = {}  # task -> client
+        last_error = None
+        hedge_slot = False  # the hedge holds its own slot, so hedges stay within MAX_CONCURRENCY
+
+        def launch():
+            client = _pick(queue)
+            if client is not None:
+                task = asyncio.create_task(client.generate(prompt, max(deadline - time.monotonic(), 0.1)))
+                running[task] = client
+            return client
+
+        if launch() is None:
+            raise Unavailable("every Gemini model is failing, try again shortly")
+        try:
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # While only the primary runs, wake up at its p95 to hedge
+                wait = min(remaining, next(iter(running.values())).hedge_delay()) if len(running) == 1 and queue else remaining
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if queue and len(running) == 1 and dispatcher.try_acquire():
+                        slow = next(iter(running.values()))
+                        hedge = launch()
+                        if hedge is None:
+                            dispatcher.release()
+                        else:
+                            hedge_slot = True
+                            model_hedges.inc(model=hedge.name)
+                            tracing.tag(hedged=hedge.name)
+                            logger.info(f"🏁 {slow.name} slower than {slow.hedge_delay():.1f}s, hedging on {hedge.name}")
+                    continue
+                for task in done:
+                    client = running.pop(task)
+                    if task.exception() is None:
+                        tracing.tag(model=client.name)
+                        return task.result()
+                    last_error = task.exception()
+                    if isinstance(last_error, ValueError):
+                        raise last_error
+                    logger.warning(f"⚠ {client.name} failed: {last_error}")
+                if hedge_slot and len(running) < 2:
+                    dispatcher.release()
+                    hedge_slot = False
+                if not running:
+                    launch()  # fall back to the next model, if any
+        finally:
+            if hedge_slot:
+                dispatcher.release()
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    if last_error is not None and not isinstance(last_error, TimeoutError):
+        raise last_error
+    logger.warning(f"⏱️ Gemini request timed out after {timeout:g}s")
+    raise TimeoutError(f"Gemini request timed out after {timeout:g}s")
+
+async def stream(prompt: str, timeout: float = None, user_id: str = None):
+    """Yields pieces of generated text as soon as Gemini streams them.
+
+    Shares the concurrency cap and lanes with generate(). Streams are not
+    hedged, but a model that fails before sending any text is skipped for
+    the next one in the chain. `timeout` bounds the wait for each streamed
+    piece, so a stalled stream is cancelled instead of hanging.
+    """
+    timeout = REQUEST_TIMEOUT if timeout is None else timeout
+    async with dispatcher.slot(user_id, CHAT if user_id else SYSTEM):
+        queue = list(clients)
+        client = _pick(queue)
+        if client is None:
+            raise Unavailable("every Gemini model is failing, try again shortly")
+        while client is not None:
+            started = time.monotonic()
+            sent = False
+            try:
+                response = await asyncio.wait_for(client.model.generate_content_async(prompt, stream=True), timeout)
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. a bare finish reason)
+                        continue
+                    if text:
+                        sent = True
+                        yield text
+            except asyncio.TimeoutError:
+                client.record("timeout")
+                logger.warning(f"⏱️ Gemini stream from {client.name} stalled for {timeout:g}s")
+                fallback = None if sent else _pick(queue)
+                if fallback is None:
+                    raise TimeoutError(f"Gemini stream stalled for {timeout:g}s") from None
+                client = fallback
+                continue
+            except (asyncio.CancelledError, GeneratorExit):
+                client.record("cancelled")
+                raise
+            except Exception as e:
+                client.record("error")
+                fallback = None if sent else _pick(queue)
+                if fallback is None:
+                    raise
+                logger.warning(f"⚠ {client.name} stream failed, trying {fallback.name}: {e}")
+                client = fallback
+                continue
+            client.record("ok", time.monotonic() - started)
+            return
+
+def status():
+    """Per-model breaker state and hedge delay, for health output."""
+    return {
+        client.name: {"circuit": client.breaker.state, "hedge_after": round(client.hedge_delay(), 2)}
+        for client in clients
+    }
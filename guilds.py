@@ -0,0 +1,145 @@
+# guilds.py
+import os
+import asyncio
+import logging
+from collections import namedtuple
+
+import discord
+
+import database
+import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger()
+
+# Discord allows a bot about 50 requests/sec in total; leave headroom for chat replies
+FANOUT_RATE = float(os.getenv("FANOUT_RATE", "40"))               # requests/sec across all guilds
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "20"))   # requests in flight at once
+FANOUT_RETRIES = 2                                                # extra tries after a 429
+
+# The server Mathy was first built for; subscribed automatically the first time it is seen
+HOME_CHANNEL_ID = int(os.getenv("DAILY_CHANNEL_ID", "1402996264278298695"))
+HOME_ROLE_ID = int(os.getenv("DAILY_ROLE_ID", "1378364940322345071"))
+
+fanout_results = metrics.counter(
+    "mathy_fanout_total", "Per-guild daily problem deliveries (sent, failed, missing channel)", ["result"]
+)
+
+GuildConfig = namedtuple("GuildConfig", "guild_id channel_id role_id")
+
+def ping(config):
+    """Role mention to put in front of a daily post, or nothing if the guild has no role set."""
+    return f"<@&{config.role_id}>\n\n" if config.role_id else ""
+
+class GuildConfigs:
+    """Which channel (and role to ping) each subscribed guild wants the daily problem in.
+
+    Loaded from the guild_config table once at startup; reads are dict
+    lookups and changes are written through to the DB before the cache.
+    """
+
+    def __init__(self):
+        self._configs = {}  # guild_id -> GuildConfig
+        self.loaded = False
+
+    async def load(self):
+        rows = await database.load_guild_configs()
+        self._configs = {row["guild_id"]: GuildConfig(row["guild_id"], row["channel_id"], row["role_id"]) for row in rows}
+        self.loaded = True
+        logger.info(f"🏠 Loaded daily problem config for {len(self._configs)} guild(s).")
+
+    async def seed_home(self, bot):
+        """Subscribes the original server unless it already has a config (even a disabled one)."""
+        channel = bot.get_channel(HOME_CHANNEL_ID)
+        if channel is None or getattr(channel, "guild", None) is None:
+            return
+        if await database.seed_guild_config(channel.guild.id, channel.id, HOME_ROLE_ID or None):
+            self._configs[channel.guild.id] = GuildConfig(channel.guild.id, channel.id, HOME_ROLE_ID or None)
+            logger.info(f"🏠 Subscribed home guild {channel.guild.id} to the daily problem.")
+
+    def get(self, guild_id):
+        return self._configs.get(guild_id)
+
+    def all(self):
+        return list(self._configs.values())
+
+    def __len__(self):
+        return len(self._configs)
+
+    async def set(self, guild_id, channel_id, role_id=None):
+        await database.save_guild_config(guild_id, channel_id, role_id)
+        config = self._configs[guild_id] = GuildConfig(guild_id, channel_id, role_id)
+        return config
+
+    async def remove(self, guild_id):
+        await database.disable_guild_config(guild_id)
+        return self._configs.pop(guild_id, None)
+
+guild_configs = GuildConfigs()
+
+class FanOut:
+    """Runs one Discord call per guild concurrently, paced to stay under the global rate limit.
+
+    Every request takes a token from a shared bucket (FANOUT_RATE per second)
+    and at most FANOUT_CONCURRENCY run at once. A 429 blocks the bucket for
+    Discord's retry_after and the request is retried up to FANOUT_RETRIES times.
+    """
+
+    def __init__(self, rate=FANOUT_RATE, concurrency=FANOUT_CONCURRENCY):
+        self.bucket = TokenBucket(rate, concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(self, fn, *args, **kwargs):
+        """One paced request, e.g. `await fan.call(channel.send, text)`."""
+        for attempt in range(FANOUT_RETRIES + 1):
+            await self.bucket.acquire()
+            async with self.semaphore:
+                try:
+                    return await fn(*args, **kwargs)
+                except discord.HTTPException as e:
+                    if e.status != 429 or attempt == FANOUT_RETRIES:
+                        raise
+                    self.bucket.penalize(float(getattr(e, "retry_after", 1.0) or 1.0))
+
+    async def map(self, items, fn):
+        """Runs `fn(item)` for every item at once; returns {item: result or the exception raised}."""
+        results = await asyncio.gather(*(fn(item) for item in items), return_exceptions=True)
+        return dict(zip(items, results))
+
+async def send_to_guilds(bot, configs, text, fan=None):
+    """Posts `text` (after each guild's role ping) to every config's channel.
+
+    Returns ({guild_id: message}, {guild_id: error}); a missing channel or a
+    permission error only loses that guild.
+    """
+    fan = fan or FanOut()
+
+    async def send(config):
+        channel = bot.get_channel(config.channel_id)
+        if channel is None:
+            raise LookupError(f"channel {config.channel_id} not found")
+        return await fan.call(channel.send, ping(config) + text)
+
+    sent, failed = {}, {}
+    for config, result in (await fan.map(configs, send)).items():
+        if isinstance(result, BaseException):
+            failed[config.guild_id] = result
+            fanout_results.inc(result="missing" if isinstance(result, LookupError) else "failed")
+        else:
+            sent[config.guild_id] = result
+            fanout_results.inc(result="sent")
+    for guild_id, error in failed.items():
+        logger.warning(f"⚠ Daily post to guild {guild_id} failed: {error}")
+    return sent, failed
+
+async def add_reactions(messages, emojis, fan=None):
+    """Adds `emojis` to every message, one message's reactions in order, messages in parallel."""
+    fan = fan or FanOut()
+
+    async def react(message):
+        for emoji in emojis:
+            await fan.call(message.add_reaction, emoji)
+
+    failures = [e for e in (await fan.map(list(messages), react)).values() if isinstance(e, BaseException)]
+    if failures:
+        logger.warning(f"⚠ Could not add vote reactions to {len(failures)} message(s): {failures[0]}")
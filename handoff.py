@@ -0,0 +1,82 @@
+# handoff.py
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from memory import write_atomic
+
+logger = logging.getLogger()
+
+RUNTIME_SNAPSHOT = os.getenv("RUNTIME_SNAPSHOT", "runtime_state.json")
+SNAPSHOT_MAX_AGE = float(os.getenv("RUNTIME_SNAPSHOT_MAX_AGE", "900"))  # older snapshots are ignored on boot
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))                 # max wait for in-flight replies
+
+class Handoff:
+    """Drains in-flight work before a restart and carries runtime state over to the next process.
+
+    Message handlers run inside `working()`. `drain()` stops new work from
+    being accepted (`draining` turns True) and waits for the running
+    handlers to finish. `save()` / `load()` move a JSON state dict through
+    RUNTIME_SNAPSHOT; a snapshot is read at most once and only if it is
+    younger than SNAPSHOT_MAX_AGE.
+    """
+
+    def __init__(self, path=RUNTIME_SNAPSHOT, max_age=SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.draining = False
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @asynccontextmanager
+    async def working(self):
+        self.inflight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Stops accepting work and waits for what's running; returns how many are still going."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠ Drain timed out with {self.inflight} replies still running.")
+        return self.inflight
+
+    def save(self, state):
+        state = dict(state, saved_at=time.time(), pid=os.getpid())
+        write_atomic(self.path, json.dumps(state))
+        logger.info(f"💾 Runtime state saved to {self.path}.")
+
+    def load(self):
+        """Returns the saved state and deletes the file, or None if missing, unreadable or stale."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠ Could not read runtime snapshot: {e}")
+            state = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        if state is None:
+            return None
+        age = time.time() - state.get("saved_at", 0)
+        if age > self.max_age:
+            logger.info(f"ℹ️ Ignoring runtime snapshot from {age:.0f}s ago.")
+            return None
+        return state
+
+handoff = Handoff()
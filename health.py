@@ -0,0 +1,112 @@
+# health.py
+import os
+import time
+import asyncio
+import logging
+
+from aiohttp import web
+
+import metrics
+import database
+from gemini import dispatcher
+from memwatch import memory_watch
+
+logger = logging.getLogger()
+
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("PORT", "8080"))              # Render sets PORT
+DB_PROBE_INTERVAL = float(os.getenv("DB_PROBE_INTERVAL", "15"))  # seconds between DB reachability checks
+DB_PROBE_TIMEOUT = 5
+
+class HealthServer:
+    """Liveness, readiness and Prometheus metrics over HTTP, on the bot's event loop.
+
+    Probes never do I/O: `/readyz` reads the gateway state off the bot and a
+    DB flag that a background task refreshes every DB_PROBE_INTERVAL
+    seconds, so it answers instantly however busy the bot is.
+    """
+
+    def __init__(self, bot, host=HTTP_HOST, port=HTTP_PORT):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.started = time.time()
+        self.db_ok = False
+        self.db_checked = None
+        self._runner = None
+        self._probe_task = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self.home)
+        app.router.add_get("/healthz", self.healthz)
+        app.router.add_get("/readyz", self.readyz)
+        app.router.add_get("/metrics", self.metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._probe_task = asyncio.create_task(self._probe_db())
+        logger.info(f"🩺 Health server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _probe_db(self):
+        while True:
+            try:
+                await asyncio.wait_for(database.ping(), DB_PROBE_TIMEOUT)
+                ok = True
+            except Exception as e:
+                ok = False
+                if self.db_ok:
+                    logger.warning(f"⚠ DB unreachable: {e}")
+            self.db_ok, self.db_checked = ok, time.time()
+            await asyncio.sleep(DB_PROBE_INTERVAL)
+
+    def readiness(self):
+        return {
+            "gateway": self.bot.is_ready() and not self.bot.is_closed(),
+            "database": self.db_ok,
+        }
+
+    async def home(self, request):
+        return web.Response(text="Mathy bot is alive!")
+
+    async def healthz(self, request):
+        # Answering at all means the event loop is running
+        return web.json_response({"status": "ok", "uptime": round(time.time() - self.started)})
+
+    async def readyz(self, request):
+        checks = self.readiness()
+        ready = all(checks.values())
+        return web.json_response({"ready": ready, **checks}, status=200 if ready else 503)
+
+    async def metrics(self, request):
+        checks = self.readiness()
+        extra = [
+            "# HELP mathy_ready Whether each readiness check passes",
+            "# TYPE mathy_ready gauge",
+        ] + [f'mathy_ready{{check="{name}"}} {int(ok)}' for name, ok in checks.items()] + [
+            "# HELP mathy_uptime_seconds Seconds since the process started",
+            "# TYPE mathy_uptime_seconds gauge",
+            f"mathy_uptime_seconds {time.time() - self.started:.0f}",
+            "# HELP mathy_db_log_total Interaction log write-behind counts (rows queued/written/spilled/replayed, batches)",
+            "# TYPE mathy_db_log_total counter",
+        ] + [f'mathy_db_log_total{{event="{event}"}} {count}' for event, count in database.log_stats.items()] + [
+            "# HELP mathy_model_queue Model calls holding or waiting for a slot",
+            "# TYPE mathy_model_queue gauge",
+        ] + [f'mathy_model_queue{{state="{state}"}} {count}' for state, count in dispatcher.stats().items()] + [
+            "# HELP mathy_rss_bytes Resident memory of the bot process",
+            "# TYPE mathy_rss_bytes gauge",
+            f"mathy_rss_bytes {memory_watch.rss()}",
+            "# HELP mathy_rss_growth_bytes RSS gained since the post-warm-up baseline",
+            "# TYPE mathy_rss_growth_bytes gauge",
+            f"mathy_rss_growth_bytes {memory_watch.growth()}",
+        ]
+        body = metrics.render() + "\n".join(extra) + "\n"
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
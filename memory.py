@@ -0,0 +1,166 @@
+# memory.py
+import os
+import json
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger()
+
+def write_atomic(path, text):
+    """Replaces `path` with `text` so readers never see a half-written file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class Conversation:
+    __slots__ = ("history", "last_reply", "last_seen", "size", "turns", "summary", "summarized_at")
+
+    def __init__(self, history_len):
+        self.history = deque(maxlen=history_len)  # (username, prompt), oldest first
+        self.last_reply = None
+        self.last_seen = time.time()
+        self.size = 0  # characters held, for the memory cap
+        self.turns = 0  # prompts ever added
+        self.summary = []  # short notes on older prompts (rolling summary)
+        self.summarized_at = 0  # value of `turns` when the summary was last refreshed
+
+class ConversationStore:
+    """Per-user recent prompts and Mathy's last reply, with bounded memory.
+
+    Users are kept in LRU order (an OrderedDict), so every lookup and
+    eviction is O(1). The least recently active user is dropped when there
+    are more than `max_users`, when the stored text exceeds `max_chars`, or
+    when they have been idle longer than `idle_ttl` seconds. `snapshot()`
+    and `restore()` persist the store to a JSON file across restarts.
+    """
+
+    def __init__(self, history_len=10, max_users=5000, max_chars=8_000_000, idle_ttl=7 * 24 * 3600):
+        self.history_len = history_len
+        self.max_users = max_users
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self._users = OrderedDict()  # user_id -> Conversation, least recently active first
+        self.total_chars = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def _get(self, user_id, create=False):
+        conversation = self._users.get(user_id)
+        if conversation is None:
+            if not create:
+                return None
+            conversation = self._users[user_id] = Conversation(self.history_len)
+        else:
+            self._users.move_to_end(user_id)
+        conversation.last_seen = time.time()
+        return conversation
+
+    def _resize(self, conversation, delta):
+        conversation.size += delta
+        self.total_chars += delta
+
+    def add_prompt(self, user_id, username, prompt):
+        conversation = self._get(user_id, create=True)
+        if len(conversation.history) == conversation.history.maxlen:
+            old_name, old_prompt = conversation.history[0]
+            self._resize(conversation, -(len(old_name) + len(old_prompt)))
+        conversation.history.append((username, prompt))
+        conversation.turns += 1
+        self._resize(conversation, len(username) + len(prompt))
+        self.evict()
+
+    def history(self, user_id):
+        """Returns the user's recent (username, prompt) pairs, oldest first."""
+        conversation = self._get(user_id)
+        return list(conversation.history) if conversation else []
+
+    def last_reply(self, user_id, default=None):
+        conversation = self._get(user_id)
+        if conversation is None or conversation.last_reply is None:
+            return default
+        return conversation.last_reply
+
+    def set_last_reply(self, user_id, reply):
+        conversation = self._get(user_id, create=True)
+        self._resize(conversation, len(reply) - len(conversation.last_reply or ""))
+        conversation.last_reply = reply
+        self.evict()
+
+    def summary(self, user_id):
+        """Returns (summary notes, turns since the summary was refreshed)."""
+        conversation = self._get(user_id)
+        if conversation is None:
+            return [], 0
+        return conversation.summary, conversation.turns - conversation.summarized_at
+
+    def set_summary(self, user_id, notes):
+        conversation = self._get(user_id, create=True)
+        self._resize(conversation, sum(map(len, notes)) - sum(map(len, conversation.summary)))
+        conversation.summary = notes
+        conversation.summarized_at = conversation.turns
+        self.evict()
+
+    def evict(self):
+        """Drops least recently active users until every bound holds."""
+        cutoff = time.time() - self.idle_ttl
+        while self._users:
+            user_id, oldest = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and self.total_chars <= self.max_chars and oldest.last_seen >= cutoff:
+                break
+            del self._users[user_id]
+            self.total_chars -= oldest.size
+            self.evictions += 1
+
+    def stats(self):
+        return {"users": len(self._users), "chars": self.total_chars, "evictions": self.evictions}
+
+    def to_dict(self):
+        return {
+            user_id: {
+                "history": list(conversation.history),
+                "last_reply": conversation.last_reply,
+                "last_seen": conversation.last_seen,
+                "turns": conversation.turns,
+                "summary": conversation.summary,
+                "summarized_at": conversation.summarized_at,
+            }
+            for user_id, conversation in self._users.items()
+        }
+
+    def snapshot(self, path):
+        """Writes the store to `path` atomically (temp file + rename)."""
+        write_atomic(path, json.dumps(self.to_dict()))
+
+    def restore(self, path):
+        """Loads a snapshot written by `snapshot()`, keeping LRU order and bounds."""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠ Could not read conversation snapshot: {e}")
+            return 0
+        for user_id, saved in data.items():
+            if user_id in self._users:
+                continue  # live data is newer than the snapshot
+            conversation = self._users[user_id] = Conversation(self.history_len)
+            for username, prompt in saved.get("history", []):
+                conversation.history.append((username, prompt))
+            conversation.last_reply = saved.get("last_reply")
+            conversation.last_seen = saved.get("last_seen", time.time())
+            conversation.turns = saved.get("turns", len(conversation.history))
+            conversation.summary = saved.get("summary", [])
+            conversation.summarized_at = saved.get("summarized_at", 0)
+            size = (sum(len(name) + len(prompt) for name, prompt in conversation.history)
+                    + len(conversation.last_reply or "") + sum(map(len, conversation.summary)))
+            self._resize(conversation, size - conversation.size)
+        self.evict()
+        return len(data)
@@ -0,0 +1,135 @@
+# memwatch.py
+import os
+import time
+import asyncio
+import logging
+import tracemalloc
+from collections import deque
+
+import psutil
+
+logger = logging.getLogger()
+
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "300"))  # seconds between RSS samples
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", "288"))                      # samples kept (24 h at 5 min)
+MEMORY_BASELINE_AFTER = float(os.getenv("MEMORY_BASELINE_AFTER", "600"))    # warm-up before the baseline sample
+# Opt-in: with a limit set, the nightly restart is skipped until RSS has grown this much past the baseline
+RESTART_GROWTH_MB = float(os.getenv("RESTART_RSS_GROWTH_MB", "0"))  # 0 = restart every night
+MEMORY_TRACE = os.getenv("MEMORY_TRACE", "0") == "1"  # tracemalloc: name the lines that grew (costs CPU)
+MB = 2 ** 20
+
+class MemoryWatch:
+    """Samples RSS over time so growth is visible (and restarts can depend on it).
+
+    The first sample after MEMORY_BASELINE_AFTER seconds, when caches have
+    warmed up, is the baseline; growth is measured against it. `track`
+    registers sizes of the bot's own structures so a report can show which
+    of them grew along with RSS.
+    """
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL, window=MEMORY_WINDOW, baseline_after=MEMORY_BASELINE_AFTER):
+        self.interval = interval
+        self.baseline_after = baseline_after
+        self.started = time.time()
+        self.samples = deque(maxlen=window)  # (time, rss bytes)
+        self.baseline = None
+        self._process = psutil.Process()
+        self._sizes = {}       # name -> callable returning a size
+        self._baseline_sizes = {}
+        self._trace_baseline = None
+        self._task = None
+
+    def track(self, name, size):
+        """Adds `size()` (a count or a stats dict) to reports, e.g. track("conversations", store.stats)."""
+        self._sizes[name] = size
+
+    def start(self):
+        if self._task is not None:
+            return
+        if MEMORY_TRACE and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def rss(self):
+        return self._process.memory_info().rss
+
+    def sample(self):
+        now, rss = time.time(), self.rss()
+        self.samples.append((now, rss))
+        if self.baseline is None and now - self.started >= self.baseline_after:
+            self.baseline = rss
+            self._baseline_sizes = self.sizes()
+            if tracemalloc.is_tracing():
+                self._trace_baseline = tracemalloc.take_snapshot()
+            logger.info(f"🧠 Memory baseline {rss / MB:.0f} MB after {now - self.started:.0f}s.")
+        return rss
+
+    def sizes(self):
+        sizes = {}
+        for name, size in self._sizes.items():
+            try:
+                sizes[name] = size()
+            except Exception as e:
+                sizes[name] = f"error: {e}"
+        return sizes
+
+    def growth(self):
+        """Bytes of RSS gained since the baseline (0 until there is one)."""
+        if self.baseline is None or not self.samples:
+            return 0
+        return self.samples[-1][1] - self.baseline
+
+    def rate(self):
+        """Least-squares RSS trend over the window, in bytes per hour."""
+        if len(self.samples) < 2:
+            return 0.0
+        t0 = self.samples[0][0]
+        xs = [(t - t0) / 3600 for t, _ in self.samples]
+        ys = [rss for _, rss in self.samples]
+        mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+        spread = sum((x - mean_x) ** 2 for x in xs)
+        if spread == 0:
+            return 0.0
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+    def should_restart(self):
+        """(restart?, why) for the nightly restart, from growth since the baseline."""
+        self.sample()
+        growth = self.growth() / MB
+        if RESTART_GROWTH_MB <= 0:
+            return True, "restart on every schedule (RESTART_RSS_GROWTH_MB=0)"
+        if self.baseline is None:
+            return False, "no memory baseline yet"
+        if growth >= RESTART_GROWTH_MB:
+            return True, f"RSS grew {growth:.0f} MB since baseline (limit {RESTART_GROWTH_MB:.0f} MB)"
+        return False, f"RSS grew {growth:.0f} MB since baseline, under {RESTART_GROWTH_MB:.0f} MB"
+
+    def report(self, top=5):
+        rss = self.sample()
+        lines = [
+            f"RSS now      {rss / MB:8.1f} MB",
+            f"baseline     {self.baseline / MB:8.1f} MB" if self.baseline else "baseline     (warming up)",
+            f"growth       {self.growth() / MB:8.1f} MB",
+            f"trend        {self.rate() / MB:8.2f} MB/h over {len(self.samples)} samples",
+            f"uptime       {(time.time() - self.started) / 3600:8.1f} h",
+        ]
+        for name, size in self.sizes().items():
+            before = self._baseline_sizes.get(name)
+            lines.append(f"{name:<12} {size}" + (f"  (baseline {before})" if before is not None else ""))
+        if self._trace_baseline is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self._trace_baseline, "lineno")
+            lines.append("top growth since baseline:")
+            lines += [f"  {stat}" for stat in diff[:top]]
+        return "\n".join(lines)
+
+memory_watch = MemoryWatch()
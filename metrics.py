@@ -0,0 +1,118 @@
+# metrics.py
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = {}
+_lock = threading.Lock()
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> count
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(self.labelnames, labels), 0)
+
+class Histogram:
+    """Counts observations into cumulative buckets, Prometheus style."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.values.get(_label_key(self.labelnames, labels))
+        return sum(series[:-1]) if series else 0
+
+    def total(self, **labels):
+        series = self.values.get(_label_key(self.labelnames, labels))
+        return series[-1] if series else 0.0
+
+def _register(metric):
+    with _lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name, help_text, labelnames=()):
+    """Returns the counter registered under `name`, creating it on first use."""
+    return _register(Counter(name, help_text, labelnames))
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+    """Returns the histogram registered under `name`, creating it on first use."""
+    return _register(Histogram(name, help_text, buckets, labelnames))
+
+@contextmanager
+def timer(histogram, **labels):
+    """Observes the time spent in the `with` block (awaits included) on `histogram`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        metrics = list(_registry.values())
+        snapshot = {metric.name: {k: list(v) if isinstance(v, list) else v for k, v in metric.values.items()} for metric in metrics}
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in snapshot[metric.name].items():
+            if metric.kind == "counter":
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, key, [("le", bound)])
+                lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+            lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, key)} {value[-1]}")
+            lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,112 @@
+# prompt.py
+import os
+import math
+
+import metrics
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))    # whole prompt, static part included
+RECENT_TURNS = int(os.getenv("PROMPT_RECENT_TURNS", "4"))              # prompts kept word for word
+LAST_REPLY_TOKENS = int(os.getenv("PROMPT_LAST_REPLY_TOKENS", "300"))  # cap on the previous reply
+SUMMARY_REFRESH_EVERY = int(os.getenv("PROMPT_SUMMARY_REFRESH", "4"))  # new prompts before re-summarizing
+SUMMARY_NOTES = 8    # older prompts remembered in the rolling summary
+NOTE_CHARS = 80      # each one clipped to this length
+SHARED_IDENT = "A student"  # stands in for the asker in prompts whose reply is shared
+
+prompt_tokens = metrics.histogram(
+    "mathy_prompt_tokens", "Estimated tokens per model prompt",
+    buckets=(250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+)
+prompt_trims = metrics.counter("mathy_prompt_trims_total", "Prompts cut down to fit the token budget")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for Gemini on English text)."""
+    return math.ceil(len(text) / 4)
+
+def clip(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 1, 0)].rstrip() + "…"
+
+class PromptBuilder:
+    """Assembles Mathy prompts within a token budget.
+
+    The template is split at its dynamic section: everything before
+    `marker` is formatted once (with the owner ID) and reused for every
+    request. Only the last RECENT_TURNS prompts are sent verbatim; older ones
+    are folded into a short rolling summary kept in the conversation store
+    and refreshed every SUMMARY_REFRESH_EVERY prompts. If the prompt is still
+    over budget, the previous reply, then the oldest history lines, then the
+    summary are cut back.
+    """
+
+    def __init__(self, template, owner_id, store, marker="Recent user prompts:", budget=PROMPT_TOKEN_BUDGET):
+        head, tail = template.split(marker, 1)
+        self.prefix = head.format(owner_id=owner_id)
+        self.prefix_tokens = estimate_tokens(self.prefix)
+        self.tail = marker + tail
+        self.store = store
+        self.budget = budget
+
+    def _summary(self, user_id, older):
+        notes, stale_turns = self.store.summary(user_id)
+        if older and (not notes or stale_turns >= SUMMARY_REFRESH_EVERY):
+            merged = list(notes)
+            for _, prompt in older:
+                note = clip(" ".join(prompt.split()), NOTE_CHARS // 4)
+                if note and note not in merged:
+                    merged.append(note)
+            notes = merged[-SUMMARY_NOTES:]
+            self.store.set_summary(user_id, notes)
+        return notes
+
+    def _render(self, summary, recent, last_reply, user_ident, user_id, user_prompt):
+        lines = []
+        if summary:
+            lines.append("(Earlier they asked about: " + "; ".join(summary) + ")")
+        lines.extend(f"{username}: {prompt}" for username, prompt in recent)
+        return self.tail.format(
+            conversation_history="\n".join(lines),
+            last_reply=last_reply,
+            user_ident=user_ident,
+            user_id=user_id,
+            user_prompt=user_prompt
+        )
+
+    def build(self, user_prompt: str, user_ident: str, user_id: str) -> str:
+        history = self.store.history(user_id)
+        recent = history[-RECENT_TURNS:] if RECENT_TURNS > 0 else []
+        older = history[:-len(recent)] if recent else history
+        summary = self._summary(user_id, older)
+        last_reply = clip(self.store.last_reply(user_id, "(No previous reply)"), LAST_REPLY_TOKENS)
+        return self._fit(summary, recent, last_reply, user_ident, user_id, user_prompt)
+
+    def build_shared(self, user_prompt: str) -> str:
+        """A prompt with no user, ID or history in it, so its reply can be given to anyone who asks the same."""
+        return self._fit([], [(SHARED_IDENT, user_prompt)], "(No previous reply)", SHARED_IDENT, "n/a", user_prompt)
+
+    def _fit(self, summary, recent, last_reply, user_ident, user_id, user_prompt):
+        tail = self._render(summary, recent, last_reply, user_ident, user_id, user_prompt)
+        trimmed = False
+        while self.prefix_tokens + estimate_tokens(tail) > self.budget:
+            trimmed = True
+            if len(last_reply) > 200:
+                last_reply = clip(last_reply, estimate_tokens(last_reply) // 2)
+            elif len(recent) > 1:
+                recent = recent[1:]  # drop the oldest line; the current prompt is last
+            elif summary:
+                summary = summary[1:]
+            else:
+                # Only the user's own prompt is left to shorten
+                room = self.budget - self.prefix_tokens - estimate_tokens(tail) + estimate_tokens(user_prompt)
+                user_prompt = clip(user_prompt, max(room, 50))
+                recent = [(recent[-1][0], user_prompt)] if recent else recent
+                tail = self._render(summary, recent, last_reply, user_ident, user_id, user_prompt)
+                break
+            tail = self._render(summary, recent, last_reply, user_ident, user_id, user_prompt)
+
+        if trimmed:
+            prompt_trims.inc()
+        full_prompt = self.prefix + tail
+        prompt_tokens.observe(estimate_tokens(full_prompt))
+        return full_prompt
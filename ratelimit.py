@@ -0,0 +1,48 @@
+# ratelimit.py
+import asyncio
+
+class TokenBucket:
+    """Paces calls on one rate-limit bucket; `acquire` waits until a token is free, `try_acquire` doesn't."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = None
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if self.updated is None:
+            self.updated = now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._refill(now)
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> float:
+        """Takes a token without waiting; returns 0, or the seconds until one is free."""
+        now = asyncio.get_running_loop().time()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def penalize(self, retry_after: float):
+        """Blocks the bucket after a 429 for as long as Discord asked."""
+        loop = asyncio.get_running_loop()
+        self.blocked_until = max(self.blocked_until, loop.time() + retry_after)
+        self.tokens = 0.0
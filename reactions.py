@@ -0,0 +1,126 @@
+# reactions.py
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+
+import discord
+
+import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger()
+
+# Discord lets a channel take roughly 4 reaction deletes per second
+REACTION_RATE = float(os.getenv("REACTION_REMOVE_RATE", "4"))      # removals/sec per channel
+REACTION_BURST = int(os.getenv("REACTION_REMOVE_BURST", "4"))      # short burst allowance
+REACTION_WORKERS = int(os.getenv("REACTION_REMOVE_WORKERS", "4"))  # concurrent removals
+REACTION_QUEUE_MAX = int(os.getenv("REACTION_QUEUE_MAX", "1000"))  # pending (message, user) pairs
+
+reaction_jobs = metrics.counter(
+    "mathy_reaction_removals_total",
+    "Superseded vote reaction cleanups (scheduled, merged, dropped, removed, failed, rate_limited)",
+    ["event"],
+)
+
+class ReactionRemover:
+    """Removes superseded vote reactions, one job per (message, user).
+
+    Jobs for the same message and user collapse into one: when it runs it
+    removes every vote the user holds except their latest, as recorded in
+    that message's vote tally. Removals run concurrently across channels and
+    are paced per channel by a token bucket (the reaction-delete route is
+    bucketed by channel). When REACTION_QUEUE_MAX jobs are pending, new ones
+    are dropped.
+    """
+
+    def __init__(self, votes, rate=REACTION_RATE, burst=REACTION_BURST,
+                 workers=REACTION_WORKERS, max_pending=REACTION_QUEUE_MAX):
+        self.votes = votes  # VoteBoard: message_id -> VoteTally
+        self.rate = rate
+        self.burst = burst
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # (message_id, user_id) -> message
+        self._buckets = {}             # channel_id -> TokenBucket
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self._pending:
+            self._wakeup.set()
+        logger.info(f"🧹 Reaction remover started ({self.workers} workers, {self.rate:g}/s per channel).")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def schedule(self, message, user_id: int):
+        """Queues cleanup of the user's older votes on `message`."""
+        key = (message.id, user_id)
+        if key in self._pending:
+            reaction_jobs.inc(event="merged")
+            return
+        if len(self._pending) >= self.max_pending:
+            reaction_jobs.inc(event="dropped")
+            return
+        self._pending[key] = message
+        reaction_jobs.inc(event="scheduled")
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._pending)
+
+    def jobs(self):
+        """Pending (message, user_id) cleanups, oldest first."""
+        return [(message, user_id) for (_, user_id), message in self._pending.items()]
+
+    def _bucket(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            (_, user_id), message = self._pending.popitem(last=False)
+            await self._cleanup(message, user_id)
+
+    async def _cleanup(self, message, user_id: int):
+        bucket = self._bucket(message.channel.id)
+        tally = self.votes.get(message.id)
+        held = tally.reactions.get(user_id, []) if tally is not None else []
+        for emoji in held[:-1]:
+            await bucket.acquire()
+            try:
+                await message.remove_reaction(emoji, discord.Object(id=user_id))
+                tally.remove(user_id, emoji)
+                reaction_jobs.inc(event="removed")
+            except discord.NotFound:
+                # reaction already gone
+                tally.remove(user_id, emoji)
+            except discord.Forbidden:
+                reaction_jobs.inc(event="failed")
+                logger.error("❌ Missing permission to remove reaction")
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    reaction_jobs.inc(event="rate_limited")
+                    bucket.penalize(float(getattr(e, "retry_after", 1.0) or 1.0))
+                    self.schedule(message, user_id)  # retry the whole job once the bucket reopens
+                    return
+                reaction_jobs.inc(event="failed")
+                logger.warning(f"⚠️ Error removing reaction: {e}")
+            except Exception as e:
+                reaction_jobs.inc(event="failed")
+                logger.warning(f"⚠️ Error removing reaction: {e}")
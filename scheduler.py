@@ -0,0 +1,250 @@
+# scheduler.py
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from utils import IST
+
+logger = logging.getLogger()
+
+RETRY_DELAY = 60           # seconds before the first retry of a failed run
+MAX_RETRY_DELAY = 15 * 60  # backoff cap
+
+def _parse_field(field: str, low: int, high: int):
+    """Parses one cron field ("*", "5", "1,15", "*/10", "0-6") into a set of ints."""
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-"))
+        else:
+            start = end = int(part)
+        if start < low or end > high:
+            raise ValueError(f"cron value out of range {low}-{high}: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """A five-field cron expression (minute hour day month weekday), evaluated in IST.
+
+    Weekdays are 0-6 with 0 = Monday, like datetime.weekday().
+    """
+
+    def __init__(self, expression: str, tz=IST):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"expected 5 cron fields, got {expression!r}")
+        self.expression = expression
+        self.tz = tz
+        self.minutes = sorted(_parse_field(fields[0], 0, 59))
+        self.hours = sorted(_parse_field(fields[1], 0, 23))
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = _parse_field(fields[4], 0, 6)
+
+    def _day_matches(self, day):
+        return day.month in self.months and day.day in self.days and day.weekday() in self.weekdays
+
+    def _slots_on(self, day):
+        for hour in self.hours:
+            for minute in self.minutes:
+                yield self.tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First scheduled time strictly after `moment`."""
+        moment = moment.astimezone(self.tz)
+        day = moment.date()
+        for _ in range(366 * 4):
+            if self._day_matches(day):
+                for slot in self._slots_on(day):
+                    if slot > moment:
+                        return slot
+            day += timedelta(days=1)
+        raise ValueError(f"cron expression never fires: {self.expression}")
+
+    def previous_at_or_before(self, moment: datetime):
+        """Latest scheduled time at or before `moment` (None if not within four years)."""
+        moment = moment.astimezone(self.tz)
+        day = moment.date()
+        for _ in range(366 * 4):
+            if self._day_matches(day):
+                for slot in reversed(list(self._slots_on(day))):
+                    if slot <= moment:
+                        return slot
+            day -= timedelta(days=1)
+        return None
+
+class Job:
+    def __init__(self, name, schedule, func, grace):
+        self.name = name
+        self.schedule = schedule
+        self.func = func
+        self.grace = grace          # how late (seconds) a missed run may still be caught up
+        self.last_run = None        # slot (aware datetime) of the last completed run
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.missed = 0
+        self.failures = 0
+
+class Scheduler:
+    """Runs registered jobs from a single heap of IST deadlines.
+
+    One task sleeps until the earliest deadline, so there are no idle
+    wakeups. Each completed run is persisted through `save_run(name, slot)`.
+    At startup, `load_runs()` is used to count slots missed while the bot was
+    down; the latest missed slot is run once if it is less than the job's
+    `grace` seconds old, and skipped otherwise. A failed run is retried with
+    exponential backoff for as long as its slot stays within `grace`.
+    """
+
+    def __init__(self, load_runs=None, save_run=None, tz=IST, retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY):
+        self.tz = tz
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.jobs = {}
+        self._load_runs = load_runs
+        self._save_run = save_run
+        self._heap = []  # (deadline, name)
+        self._changed = None
+        self._task = None
+
+    def cron(self, name: str, expression: str, grace: float = 0):
+        """Decorator registering `func` to run on a cron expression (IST)."""
+        def register(func):
+            self.jobs[name] = Job(name, CronSchedule(expression, self.tz), func, grace)
+            if self._task is not None:
+                self._push(self.jobs[name], datetime.now(self.tz))
+            return func
+        return register
+
+    def daily(self, name: str, hour: int, minute: int = 0, grace: float = 0):
+        """Decorator registering `func` to run every day at hour:minute IST."""
+        return self.cron(name, f"{minute} {hour} * * *", grace)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._changed = asyncio.Event()
+        last_runs = {}
+        if self._load_runs is not None:
+            try:
+                last_runs = await self._load_runs()
+            except Exception as e:
+                logger.error(f"❌ Could not load scheduler state, no catch-up this boot: {e}")
+
+        now = datetime.now(self.tz)
+        for job in self.jobs.values():
+            job.last_run = last_runs.get(job.name)
+            self._catch_up(job, now)
+            self._push(job, now)
+        self._task = asyncio.create_task(self._loop())
+        for job in sorted(self.jobs.values(), key=lambda j: j.next_run):
+            logger.info(f"⏰ {job.name}: next run {job.next_run:%Y-%m-%d %H:%M} IST")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _catch_up(self, job, now):
+        if job.last_run is None:
+            return  # never ran (or state unknown): start with the next slot
+        due = job.schedule.previous_at_or_before(now)
+        if due is None or due <= job.last_run:
+            return
+        # Count every slot between the last recorded run and now
+        missed, slot = 0, job.schedule.next_after(job.last_run)
+        while slot <= due and missed < 1000:
+            missed += 1
+            slot = job.schedule.next_after(slot)
+        job.missed += missed
+        late = (now - due).total_seconds()
+        if late <= job.grace:
+            logger.warning(f"⏰ {job.name}: missed {missed} run(s), catching up the {due:%Y-%m-%d %H:%M} slot now")
+            asyncio.create_task(self._run(job, due))
+        else:
+            logger.warning(f"⏰ {job.name}: missed {missed} run(s), last one {late / 60:.0f} min ago is past its grace window")
+
+    def _push(self, job, after):
+        job.next_run = job.schedule.next_after(after)
+        heapq.heappush(self._heap, (job.next_run, job.name))
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _loop(self):
+        while True:
+            if not self._heap:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            deadline, name = self._heap[0]
+            wait = (deadline - datetime.now(self.tz)).total_seconds()
+            if wait > 0:
+                # Sleep until the deadline, or until a new job is registered
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            job = self.jobs.get(name)
+            if job is None or job.next_run != deadline:
+                continue  # stale heap entry
+            self._push(job, deadline)
+            asyncio.create_task(self._run(job, deadline))
+
+    async def _run(self, job, slot):
+        if job.running:
+            logger.warning(f"⏰ {job.name}: previous run still in progress, skipping {slot:%H:%M} slot")
+            return
+        job.running = True
+        try:
+            logger.info(f"⏰ Running {job.name} ({slot:%Y-%m-%d %H:%M} IST slot)")
+            delay = self.retry_delay
+            while True:
+                try:
+                    await job.func()
+                    break
+                except Exception as e:
+                    job.failures += 1
+                    # Retry with backoff while the slot is still within the job's grace window
+                    late = (datetime.now(self.tz) - slot).total_seconds() + delay
+                    if late > job.grace:
+                        logger.error(f"❌ Job {job.name} failed: {e}")
+                        return
+                    logger.warning(f"⏰ {job.name} failed ({e}), retrying in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+        finally:
+            job.running = False
+        job.runs += 1
+        job.last_run = slot
+        if self._save_run is not None:
+            try:
+                await self._save_run(job.name, slot)
+            except Exception as e:
+                logger.error(f"❌ Could not persist run of {job.name}: {e}")
+
+    def status(self):
+        return {
+            name: {
+                "next_run": job.next_run.isoformat() if job.next_run else None,
+                "last_run": job.last_run.isoformat() if job.last_run else None,
+                "runs": job.runs,
+                "missed": job.missed,
+                "failures": job.failures,
+            }
+            for name, job in self.jobs.items()
+        }
@@ -0,0 +1,39 @@
+# startup.py
+import os
+import time
+from contextlib import contextmanager
+
+import psutil
+
+# Wall-clock start of the process, so interpreter start-up and imports count too.
+# A hot restart execs in the same process (same create_time), so bot.py passes
+# the restart time on through MATHY_STARTED instead.
+PROCESS_STARTED = float(os.environ.pop("MATHY_STARTED", 0)) or psutil.Process().create_time()
+
+_marks = {}   # milestone -> seconds since PROCESS_STARTED (first time only)
+_phases = []  # (name, start offset, duration); phases may overlap
+
+def mark(name):
+    """Records a milestone the first time it is reached; returns True if this was the first time."""
+    if name in _marks:
+        return False
+    _marks[name] = since_start()
+    return True
+
+def since_start():
+    return time.time() - PROCESS_STARTED
+
+@contextmanager
+def phase(name):
+    """Times one startup step: `with startup.phase("db init"): ...`."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        _phases.append((name, started - PROCESS_STARTED, time.time() - started))
+
+def report():
+    """Milestones and phases in start order, e.g. `+1.20s  0.35s  db init`."""
+    rows = [(offset, f"+{offset:6.2f}s          {name}") for name, offset in _marks.items()]
+    rows += [(offset, f"+{offset:6.2f}s {duration:6.2f}s  {name}") for name, offset, duration in _phases]
+    return "\n".join(line for _, line in sorted(rows))
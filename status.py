@@ -0,0 +1,142 @@
+# status.py
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+
+from memory import write_atomic
+
+logger = logging.getLogger()
+
+STATUS_FILE = "bot_status.json"
+STATUS_HOST = os.getenv("STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.getenv("STATUS_PORT", "8765"))  # UDP port status_monitor.py listens on
+PERSIST_DELAY = 1.0  # seconds; changes within this window share one file write
+HEARTBEAT_INTERVAL = float(os.getenv("STATUS_HEARTBEAT", "5"))  # seconds between liveness datagrams
+PID_FILE = os.getenv("BOT_PID_FILE", "bot.pid")
+
+class BotStatus:
+    """The bot's status flags, kept in memory and pushed to the LED monitor.
+
+    Every change bumps `seq` and is sent as one JSON datagram to
+    STATUS_HOST:STATUS_PORT (fire and forget, nothing waits on the
+    monitor). Events are counters rather than flags, e.g. `flashes` counts
+    mentions, so the monitor acts on an increase and never has to write
+    back. The same state is also written to STATUS_FILE by atomic rename,
+    off the event loop and at most once per PERSIST_DELAY, for monitors
+    that can't receive the datagrams.
+
+    While started, the current state is also re-sent every
+    HEARTBEAT_INTERVAL seconds as a liveness signal, and the process ID is
+    kept in PID_FILE.
+    """
+
+    def __init__(self, path=STATUS_FILE, address=(STATUS_HOST, STATUS_PORT)):
+        self.path = path
+        self.address = address
+        self._lock = threading.Lock()
+        self._state = {
+            "pid": os.getpid(),
+            "started": time.time(),
+            "seq": 0,
+            "error": False,
+            "errors": 0,
+            "flashes": 0,
+            "timestamp": time.time(),
+        }
+        self._socket = None
+        self._persist_pending = False
+        self._write_lock = threading.Lock()
+        self._heartbeat_task = None
+
+    def start(self):
+        """Writes the pidfile and starts the heartbeat (call from the event loop)."""
+        try:
+            write_atomic(PID_FILE, str(os.getpid()))
+        except OSError as e:
+            logger.error(f"❌ Failed to write {PID_FILE}: {e}")
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        try:
+            with open(PID_FILE, "r") as f:
+                ours = f.read().strip() == str(os.getpid())
+            if ours:
+                os.remove(PID_FILE)  # a restarted bot may already have written its own
+        except OSError:
+            pass
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                payload = json.dumps(self._state)
+            self._publish(payload)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._state)
+
+    def _update(self, **changes):
+        with self._lock:
+            state = self._state
+            for key, value in changes.items():
+                state[key] = value(state[key]) if callable(value) else value
+            state["seq"] += 1
+            state["timestamp"] = time.time()
+            payload = json.dumps(state)
+        self._publish(payload)
+        self._schedule_persist()
+
+    def flash(self):
+        """Someone mentioned the bot: flash both LEDs."""
+        self._update(flashes=lambda n: n + 1)
+
+    def set_error(self, value: bool = True):
+        if value:
+            self._update(error=True, errors=lambda n: n + 1)
+        else:
+            self._update(error=False)
+
+    def reset(self):
+        self._update(error=False)
+
+    def _publish(self, payload):
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._socket.setblocking(False)
+            self._socket.sendto(payload.encode(), self.address)
+        except OSError:
+            pass  # no monitor listening (or a full buffer); the file still has the state
+
+    def _schedule_persist(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.persist()  # no event loop (startup/shutdown): write straight away
+            return
+        with self._lock:
+            if self._persist_pending:
+                return
+            self._persist_pending = True
+        loop.call_later(PERSIST_DELAY, lambda: loop.run_in_executor(None, self.persist))
+
+    def persist(self):
+        with self._lock:
+            self._persist_pending = False
+            payload = json.dumps(self._state)
+        try:
+            with self._write_lock:
+                write_atomic(self.path, payload)
+        except OSError as e:
+            logger.error(f"❌ Failed to write {self.path}: {e}")
+
+bot_status = BotStatus()
@@ -3,118 +3,205 @@ import psutil
 import time
 import os
 import json
+import select
+import socket
+import argparse
 
 BOT_NAME = "bot.py"
-COM_PORT = "COM5"
+COM_PORT = os.getenv("ARDUINO_PORT", "COM5")
 BAUD_RATE = 9600
 
 STATUS_FILE = "bot_status.json"
-downtime_start = None
-prev_command = None
-
-# Connect to Arduino
-try:
-    arduino = serial.Serial(COM_PORT, BAUD_RATE, timeout=1)
-    time.sleep(2)
-    print(f"Connected to Arduino via {COM_PORT}")
-except Exception as e:
-    print(f"Failed to connect to Arduino: {e}")
-    exit()
-
-def is_bot_running():
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-        cmdline = proc.info.get('cmdline')
-        if cmdline and isinstance(cmdline, list):
-            if BOT_NAME in " ".join(cmdline):
-                return True
-    return False
-
-def send_command(cmd):
-    try:
-        arduino.write((cmd + "\n").encode())
-        print(f"Sent command to Arduino: {cmd}")
-    except Exception as e:
-        print(f"Failed to send command: {e}")
-
-def read_status():
-    try:
-        if os.path.exists(STATUS_FILE):
-            with open(STATUS_FILE, "r") as f:
+PID_FILE = os.getenv("BOT_PID_FILE", "bot.pid")
+STATUS_HOST = os.getenv("STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.getenv("STATUS_PORT", "8765"))
+FILE_FALLBACK_AFTER = 10  # seconds without a datagram before STATUS_FILE is read instead
+HEARTBEAT_TIMEOUT = float(os.getenv("STATUS_HEARTBEAT_TIMEOUT", "15"))  # bot sends one every 5 s
+PID_CHECK_INTERVAL = 5    # seconds between pidfile checks when no heartbeats arrive
+DOWNTIME_ALERT = 30       # seconds down before the red LED starts flashing
+
+class StatusListener:
+    """Receives status datagrams from the bot, falling back to STATUS_FILE.
+
+    The bot only ever writes the status; this side just watches its `flashes`
+    and `errors` counters and reports how much each went up since last time.
+    Any datagram, including the bot's periodic heartbeat, refreshes
+    `last_datagram`.
+    """
+
+    def __init__(self, host=STATUS_HOST, port=STATUS_PORT, path=STATUS_FILE):
+        self.path = path
+        self.state = {}
+        self.seen = None  # (pid, flashes, errors) already acted on
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.last_datagram = 0.0
+
+    def _newer(self, status):
+        return (status.get("pid"), status.get("started")) != (self.state.get("pid"), self.state.get("started")) \
+            or status.get("seq", 0) > self.state.get("seq", 0)
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r") as f:
                 return json.load(f)
-    except Exception as e:
-        print(f"Error reading status: {e}")
-    return {}
-
-def write_status(status):
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading status: {e}")
+            return None
+
+    def poll(self, timeout):
+        """Waits up to `timeout` seconds for status updates; returns (new flashes, new errors)."""
+        readable, _, _ = select.select([self.sock], [], [], max(timeout, 0))
+        if readable:
+            while True:
+                try:
+                    data = self.sock.recv(65535)
+                except BlockingIOError:
+                    break
+                try:
+                    status = json.loads(data)
+                except ValueError:
+                    continue
+                self.last_datagram = time.time()
+                if self._newer(status):
+                    self.state = status
+        elif time.time() - self.last_datagram > FILE_FALLBACK_AFTER:
+            status = self._read_file()
+            if status and self._newer(status):
+                self.state = status
+        return self._events()
+
+    def _events(self):
+        if not self.state:
+            return 0, 0
+        current = (self.state.get("pid"), self.state.get("flashes", 0), self.state.get("errors", 0))
+        if self.seen is None or self.seen[0] != current[0]:
+            self.seen = current  # first status from this bot process: nothing to replay
+            return 0, 0
+        flashes, errors = current[1] - self.seen[1], current[2] - self.seen[2]
+        self.seen = current
+        return max(flashes, 0), max(errors, 0)
+
+    def close(self):
+        self.sock.close()
+
+def pidfile_alive(path=PID_FILE):
+    """True if the pidfile names a live process running the bot."""
+    try:
+        with open(path, "r") as f:
+            pid = int(f.read().strip())
+        cmdline = psutil.Process(pid).cmdline()
+    except (OSError, ValueError, psutil.Error):
+        return False
+    return BOT_NAME in " ".join(cmdline)
+
+class Monitor:
+    """Drives the Arduino LEDs from the bot's heartbeat and status events.
+
+    The bot counts as up while heartbeats keep arriving (or, with none heard
+    for HEARTBEAT_TIMEOUT, while its pidfile names a live bot process). LED
+    modes (green_on, red_on, flash_red) are only sent when they change; flash
+    and error signals are sent once per event and then the mode is restored.
+    """
+
+    def __init__(self, port, listener):
+        self.port = port
+        self.listener = listener
+        self.mode = None
+        self.down_since = None
+        self.pid_checked = 0.0
+        self.pid_alive = False
+
+    def send_command(self, cmd):
+        try:
+            self.port.write((cmd + "\n").encode())
+            print(f"Sent command to Arduino: {cmd}")
+        except Exception as e:
+            print(f"Failed to send command: {e}")
+
+    def set_mode(self, mode):
+        if mode != self.mode:
+            self.send_command(mode)
+            self.mode = mode
+
+    def signal(self, cmd):
+        self.send_command(cmd)
+        if self.mode is not None:
+            self.send_command(self.mode)
+
+    def bot_alive(self, now):
+        if now - self.listener.last_datagram <= HEARTBEAT_TIMEOUT:
+            return True
+        if now - self.pid_checked >= PID_CHECK_INTERVAL:
+            self.pid_alive = pidfile_alive()
+            self.pid_checked = now
+        return self.pid_alive
+
+    def step(self, now):
+        """Updates the LED mode; returns seconds until the verdict could next change."""
+        if self.bot_alive(now):
+            if self.down_since is not None:
+                print("Bot is back up.")
+            self.down_since = None
+            self.set_mode("green_on")
+            if now - self.listener.last_datagram <= HEARTBEAT_TIMEOUT:
+                return self.listener.last_datagram + HEARTBEAT_TIMEOUT - now
+            return self.pid_checked + PID_CHECK_INTERVAL - now
+
+        if self.down_since is None:
+            self.down_since = now
+        down_for = now - self.down_since
+        if down_for >= DOWNTIME_ALERT:
+            if self.mode != "flash_red":
+                print(f"Downtime >{DOWNTIME_ALERT}s detected, flashing red until bot restarts...")
+            self.set_mode("flash_red")
+            return self.pid_checked + PID_CHECK_INTERVAL - now
+        self.set_mode("red_on")
+        return min(DOWNTIME_ALERT - down_for, self.pid_checked + PID_CHECK_INTERVAL - now)
+
+    def run(self):
+        while True:
+            wait = self.step(time.time())
+            # Sleeps until a datagram arrives or the liveness verdict could change
+            flashes, errors = self.listener.poll(max(wait, 0.05))
+            if flashes:
+                print(f"[FLASH_BOTH] Bot mentioned ({flashes}x), flashing both LEDs.")
+                self.signal("flash_both")
+            if errors:
+                print(f"[ERROR] Bot reported {errors} error(s).")
+                self.signal("error")
+
+def main(argv=None, serial_port=None):
+    """Runs the monitor. Pass `serial_port` (anything with .write) to skip opening a real port."""
+    parser = argparse.ArgumentParser(description="Mirror Mathy's status on the Arduino LEDs.")
+    parser.add_argument("--port", default=COM_PORT, help="serial port of the Arduino (or a pty for testing)")
+    parser.add_argument("--baud", type=int, default=BAUD_RATE)
+    args = parser.parse_args(argv)
+
+    if serial_port is None:
+        # Connect to Arduino
+        try:
+            serial_port = serial.Serial(args.port, args.baud, timeout=1)
+            time.sleep(2)
+            print(f"Connected to Arduino via {args.port}")
+        except Exception as e:
+            print(f"Failed to connect to Arduino: {e}")
+            return 1
+
+    monitor = Monitor(serial_port, StatusListener())
     try:
-        with open(STATUS_FILE, "w") as f:
-            json.dump(status, f)
+        monitor.run()
+    except KeyboardInterrupt:
+        print("Stopped monitor.")
     except Exception as e:
-        print(f"Error writing status: {e}")
-
-def clear_flash_both(status):
-    if "flash_both" in status:
-        del status["flash_both"]
-        write_status(status)
-        print("Cleared flash_both flag from status.")
-
-def clear_error(status):
-    if "error" in status:
-        del status["error"]
-        write_status(status)
-        print("Cleared error flag from status.")
-
-def check_ping_status():
-    status = read_status()
-
-    if status.get("flash_both", False):
-        print("[FLASH_BOTH] Detected request to flash both LEDs.")
-        send_command("flash_both")
-        clear_flash_both(status)
-        send_command("green_on")
-
-    elif status.get("ping", False):
-        print("[PING] Bot pinged, flashing both LEDs.")
-        send_command("flash_both")
-        time.sleep(5)
-        status["ping"] = False
-        write_status(status)
-        send_command("green_on")
-
-def check_error():
-    status = read_status()
-    if status.get("error", False):
-        print("[ERROR] Detected error flag in status.")
-        send_command("error")
-        clear_error(status)
-        # Uncomment the next line if you want to immediately turn green on after error signal
-        send_command("green_on")
-
-try:
-    while True:
-        if is_bot_running():
-            send_command("green_on")
-            downtime_start = None
-        else:
-            if downtime_start is None:
-                downtime_start = time.time()
-                send_command("red_on")
-            elif time.time() - downtime_start >= 30:
-                print("Downtime >30s detected, flashing red until bot restarts...")
-                while True:
-                    send_command("flash_red")
-                    if is_bot_running():
-                        break
-                send_command("green_on")
-                downtime_start = None  # Reset downtime
-
-        check_ping_status()
-        check_error()
-        time.sleep(2)
-
-except KeyboardInterrupt:
-    print("Stopped monitor.")
-except Exception as e:
-    print(f"An error occurred: {e}")
-finally:
-    send_command("red_on")
+        print(f"An error occurred: {e}")
+    finally:
+        monitor.send_command("red_on")
+        monitor.listener.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,62 @@
+# streaming.py
+import os
+import asyncio
+import logging
+
+import metrics
+from utils import chunk_message, discord_latency
+
+logger = logging.getLogger()
+
+# Discord allows roughly 5 edits per 5 s per channel, so stay just under it
+EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+EMPTY_REPLY = "😶 My brain returned a blank page on that one, try asking again?"
+
+class StreamingReply:
+    """Shows a reply in a channel while it is still being generated.
+
+    The first piece is posted immediately; after that the visible messages are
+    edited at most once per `interval` seconds. Text past the character limit
+    rolls over into a new message, split the same way as chunk_message.
+    """
+
+    def __init__(self, channel, limit=2000, interval=EDIT_INTERVAL):
+        self.channel = channel
+        self.limit = limit
+        self.interval = interval
+        self.text = ""
+        self.messages = []  # discord.Message objects, one per page
+        self.shown = []     # text currently visible in each message
+        self.last_flush = 0.0
+
+    async def update(self, text: str):
+        """Records the latest full reply text and flushes it if the cadence allows."""
+        self.text = text
+        loop = asyncio.get_running_loop()
+        if not self.messages or loop.time() - self.last_flush >= self.interval:
+            await self._flush()
+
+    async def finish(self):
+        """Waits out the edit cadence if needed and shows the final text (a fallback if it was empty)."""
+        if self.messages:
+            wait = self.interval - (asyncio.get_running_loop().time() - self.last_flush)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        if not self.text.strip() and not self.messages:
+            logger.warning("⚠ Streamed reply was empty, sending a fallback.")
+            self.text = EMPTY_REPLY
+        await self._flush()
+
+    async def _flush(self):
+        pages = [page for page in chunk_message(self.text, self.limit) if page.strip()]
+        for i, page in enumerate(pages):
+            if i < len(self.messages):
+                if self.shown[i] != page:
+                    with metrics.timer(discord_latency, op="edit"):
+                        await self.messages[i].edit(content=page)
+                    self.shown[i] = page
+            else:
+                with metrics.timer(discord_latency, op="send"):
+                    self.messages.append(await self.channel.send(page))
+                self.shown.append(page)
+        self.last_flush = asyncio.get_running_loop().time()
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+
+from scheduler import Scheduler
+from utils import IST
+
+
+def flaky(failures):
+    """A job that raises `failures` times, then succeeds; returns (job func, call list)."""
+    calls = []
+
+    async def job():
+        calls.append(datetime.now(IST))
+        if len(calls) <= failures:
+            raise RuntimeError("discord hiccup")
+
+    return job, calls
+
+
+def run_slot(scheduler, name, grace):
+    async def main():
+        job = scheduler.jobs[name]
+        job.grace = grace
+        slot = datetime.now(IST)
+        await scheduler._run(job, slot)
+        return job, slot
+    return asyncio.run(main())
+
+
+def test_failed_run_is_retried_within_grace():
+    saved = []
+
+    async def save_run(name, slot):
+        saved.append((name, slot))
+
+    scheduler = Scheduler(save_run=save_run, retry_delay=0.01, max_retry_delay=0.02)
+    func, calls = flaky(failures=2)
+    scheduler.daily("daily_problem", hour=0)(func)
+
+    job, slot = run_slot(scheduler, "daily_problem", grace=60)
+
+    assert len(calls) == 3
+    assert (job.failures, job.runs) == (2, 1)
+    assert job.last_run == slot
+    assert saved == [("daily_problem", slot)]
+    assert not job.running
+
+
+def test_backoff_doubles_up_to_the_cap():
+    scheduler = Scheduler(retry_delay=0.01, max_retry_delay=0.02)
+    func, calls = flaky(failures=3)
+    scheduler.daily("daily_problem", hour=0)(func)
+
+    run_slot(scheduler, "daily_problem", grace=60)
+
+    gaps = [(b - a).total_seconds() for a, b in zip(calls, calls[1:])]
+    assert gaps[0] >= 0.01 and gaps[1] >= 0.02 and gaps[2] < 0.04
+
+
+def test_no_retry_past_grace():
+    scheduler = Scheduler(retry_delay=0.05)
+    func, calls = flaky(failures=5)
+    scheduler.daily("restart", hour=2)(func)
+
+    job, _ = run_slot(scheduler, "restart", grace=0)
+
+    assert len(calls) == 1
+    assert (job.failures, job.runs, job.last_run) == (1, 0, None)
+
+
+def test_retries_stop_when_grace_runs_out():
+    scheduler = Scheduler(retry_delay=0.02, max_retry_delay=0.02)
+    func, calls = flaky(failures=100)
+    scheduler.daily("vote_summary", hour=23)(func)
+
+    job, _ = run_slot(scheduler, "vote_summary", grace=0.1)
+
+    assert 2 <= len(calls) <= 6
+    assert job.runs == 0 and not job.running
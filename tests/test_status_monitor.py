@@ -0,0 +1,82 @@
+import os
+import pty
+import select
+
+import pytest
+import serial
+
+import status_monitor
+from status_monitor import Monitor, HEARTBEAT_TIMEOUT, DOWNTIME_ALERT
+
+
+class FakeListener:
+    def __init__(self, last_datagram):
+        self.last_datagram = last_datagram
+
+
+@pytest.fixture
+def arduino():
+    """A pty standing in for the Arduino: (serial port on the slave end, master fd to read from)."""
+    master, slave = pty.openpty()
+    port = serial.Serial(os.ttyname(slave), status_monitor.BAUD_RATE, timeout=1)
+    yield port, master
+    port.close()
+    os.close(slave)
+    os.close(master)
+
+
+def received(master):
+    """Commands written to the pty since the last call."""
+    data = b""
+    while select.select([master], [], [], 0.1)[0]:
+        data += os.read(master, 1024)
+    return data.decode().split()
+
+
+def test_led_commands_only_on_state_change(arduino, monkeypatch):
+    port, master = arduino
+    monkeypatch.setattr(status_monitor, "pidfile_alive", lambda: False)
+    listener = FakeListener(last_datagram=100.0)
+    monitor = Monitor(port, listener)
+
+    monitor.step(100.0)
+    assert received(master) == ["green_on"]
+    monitor.step(101.0)
+    assert received(master) == []
+
+    # Heartbeats stop and the pidfile names no bot: red, then flashing once down long enough
+    down = 100.0 + HEARTBEAT_TIMEOUT + 1
+    monitor.step(down)
+    assert received(master) == ["red_on"]
+    monitor.step(down + 1)
+    assert received(master) == []
+    monitor.step(down + DOWNTIME_ALERT)
+    assert received(master) == ["flash_red"]
+    monitor.step(down + DOWNTIME_ALERT + 5)
+    assert received(master) == []
+
+    # A heartbeat brings it back
+    listener.last_datagram = down + DOWNTIME_ALERT + 6
+    monitor.step(listener.last_datagram)
+    assert received(master) == ["green_on"]
+
+
+def test_pidfile_keeps_bot_up_without_heartbeats(arduino, monkeypatch):
+    port, master = arduino
+    monkeypatch.setattr(status_monitor, "pidfile_alive", lambda: True)
+    monitor = Monitor(port, FakeListener(last_datagram=0.0))
+
+    monitor.step(1000.0)
+    monitor.step(1000.0 + DOWNTIME_ALERT)
+    assert received(master) == ["green_on"]
+
+
+def test_signal_restores_mode(arduino):
+    port, master = arduino
+    monitor = Monitor(port, FakeListener(last_datagram=100.0))
+    monitor.step(100.0)
+    received(master)
+
+    monitor.signal("flash_both")
+    assert received(master) == ["flash_both", "green_on"]
+    assert monitor.mode == "green_on"
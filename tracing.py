@@ -0,0 +1,130 @@
+# tracing.py
+import os
+import time
+import random
+import logging
+import secrets
+import contextvars
+from collections import defaultdict, deque
+
+import metrics
+
+logger = logging.getLogger()
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # share of requests traced (0 = off)
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))   # traced requests slower than this are logged
+REPORT_WINDOW = 500  # recent durations per stage kept for report()
+
+stage_seconds = metrics.histogram("mathy_stage_seconds", "Duration of traced pipeline stages", labelnames=["stage"])
+
+_current = contextvars.ContextVar("mathy_trace", default=None)
+_recent = defaultdict(lambda: deque(maxlen=REPORT_WINDOW))  # stage -> recent durations
+
+class Trace:
+    """One sampled request: an ID, tags and the (stage, start offset, duration) of each span."""
+
+    __slots__ = ("id", "name", "started", "spans", "tags")
+
+    def __init__(self, name, tags):
+        self.id = secrets.token_hex(4)
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self.tags = tags
+
+class _Noop:
+    """Stands in for spans and traces that aren't sampled; costs one attribute lookup."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _Noop()
+
+class _Span:
+    __slots__ = ("trace", "stage", "started")
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ended = time.perf_counter()
+        self.trace.spans.append((self.stage, self.started - self.trace.started, ended - self.started))
+        return False
+
+class _Root:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        _finish(self.trace, time.perf_counter() - self.trace.started)
+        return False
+
+def trace(name, **tags):
+    """Starts a request trace (`with trace("mention", user=...)`), sampled at TRACE_SAMPLE_RATE."""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return _NOOP
+    return _Root(Trace(name, tags))
+
+def span(stage):
+    """Times a stage of the current request; a no-op outside a sampled trace."""
+    current = _current.get()
+    if current is None:
+        return _NOOP
+    return _Span(current, stage)
+
+def tag(**tags):
+    """Attaches details (cache hit, model path, ...) to the current trace."""
+    current = _current.get()
+    if current is not None:
+        current.tags.update(tags)
+
+def record(stage, started):
+    """Adds a span that began at perf_counter() value `started` and ends now."""
+    current = _current.get()
+    if current is not None:
+        current.spans.append((stage, started - current.started, time.perf_counter() - started))
+
+def current_id():
+    current = _current.get()
+    return current.id if current is not None else None
+
+def _finish(trace, total):
+    trace.spans.append((trace.name, 0.0, total))
+    for stage, _, duration in trace.spans:
+        stage_seconds.observe(duration, stage=stage)
+        _recent[stage].append(duration)
+    if total >= TRACE_SLOW_SECONDS:
+        ordered = sorted(trace.spans[:-1], key=lambda s: s[1])  # by start time
+        stages = ", ".join(f"{stage} +{offset * 1000:.0f}ms {duration * 1000:.0f}ms" for stage, offset, duration in ordered)
+        tags = " ".join(f"{key}={value}" for key, value in trace.tags.items())
+        logger.warning(f"🐌 Slow {trace.name} [{trace.id}] {total:.2f}s {tags} | {stages}")
+
+def report():
+    """Per-stage count, mean, p50 and p95 (ms) over the last REPORT_WINDOW traced requests."""
+    lines = []
+    for stage, durations in sorted(_recent.items()):
+        ordered = sorted(durations)
+        if not ordered:
+            continue
+        def pct(p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+        mean = sum(ordered) / len(ordered) * 1000
+        lines.append(f"{stage:<24} n={len(ordered):<4} mean={mean:7.1f}ms p50={pct(0.5):7.1f}ms p95={pct(0.95):7.1f}ms")
+    return "\n".join(lines) if lines else "No traced requests yet."
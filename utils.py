@@ -1,56 +1,159 @@
 # utils.py
 import os
+import gzip
 import json
-import asyncio
+import time
+import queue
+import shutil
+import atexit
 import re
 import logging
+import threading
 from datetime import datetime
 import pytz
 import discord
 
+import metrics
+import tracing
+from status import bot_status
+
 logger = logging.getLogger()
-STATUS_FILE = "bot_status.json"
 LOG_FILE = "message_logs.jsonl"
 IST = pytz.timezone('Asia/Kolkata')
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(10 * 1024 * 1024)))  # rotate at 10 MB...
+LOG_FSYNC_INTERVAL = float(os.getenv("LOG_FSYNC_INTERVAL", "5"))              # ...or at midnight
+LOG_BUFFER_MAX = int(os.getenv("LOG_BUFFER_MAX", "10000"))                    # lines waiting for disk
+
+discord_latency = metrics.histogram("mathy_discord_seconds", "Discord message send/edit latency", labelnames=["op"])
 
 def set_error_flag(value: bool = True):
-    """Set or clear the error flag in the bot status file."""
-    try:
-        data = {}
-        if os.path.exists(STATUS_FILE):
-            with open(STATUS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        data["error"] = value
-        with open(STATUS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
-        logger.info(f"⚠️ Set error flag to {value} in {STATUS_FILE}")
-    except Exception as e:
-        logger.error(f"❌ Failed to set error flag: {e}")
+    """Set or clear the error flag in the bot status."""
+    bot_status.set_error(value)
+    logger.info(f"⚠️ Set error flag to {value}")
 
 def reset_status():
     """Reset bot status flags."""
-    if os.path.exists(STATUS_FILE):
-        with open(STATUS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        data["flash_both"] = False
-        data["error"] = False
-        data["timestamp"] = asyncio.get_event_loop().time()
-    else:
-        data = {"flash_both": False, "timestamp": asyncio.get_event_loop().time()}
-    with open(STATUS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f)
+    bot_status.reset()
     logger.info("✅ Bot status reset.")
 
+class JsonlWriter:
+    """Appends JSON lines to a file from a background thread.
+
+    Callers never touch the disk: records are queued and written in batches,
+    fsynced every `fsync_interval` seconds. The file is rotated when it grows
+    past `max_bytes` or when the day changes, and old segments are gzipped
+    next to it (message_logs-2025-08-07.jsonl.gz, ...-2025-08-07.1.jsonl.gz).
+    If the queue is full the record is dropped and counted in `dropped`.
+    """
+
+    def __init__(self, path, max_bytes=LOG_ROTATE_BYTES, fsync_interval=LOG_FSYNC_INTERVAL, max_pending=LOG_BUFFER_MAX):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+                    self._thread.start()
+        try:
+            self.queue.put_nowait(json.dumps(record) + "\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        """Writes out everything queued, fsyncs and stops the thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+        self._thread = None
+
+    def _segment_path(self, day):
+        base, ext = os.path.splitext(self.path)
+        candidate = f"{base}-{day}{ext}.gz"
+        n = 0
+        while os.path.exists(candidate):
+            n += 1
+            candidate = f"{base}-{day}.{n}{ext}.gz"
+        return candidate
+
+    def _rotate(self, f, day):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        rotated = f"{self.path}.rotating"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(self._segment_path(day), "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self.rotations += 1
+        return open(self.path, "a", encoding="utf-8")
+
+    def _run(self):
+        f = open(self.path, "a", encoding="utf-8")
+        # Day of the data already in the file, so a restart after midnight still rotates it
+        day = datetime.fromtimestamp(os.path.getmtime(self.path)).date() if f.tell() else datetime.now().date()
+        last_sync = time.monotonic()
+        dirty = False
+        stop = False
+        try:
+            while not stop:
+                try:
+                    lines = [self.queue.get(timeout=self.fsync_interval)]
+                except queue.Empty:
+                    lines = []
+                while len(lines) < 500:
+                    try:
+                        lines.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in lines:
+                    stop = True
+                    lines = [line for line in lines if line is not None]
+
+                today = datetime.now().date()
+                if f.tell() and (today != day or f.tell() >= self.max_bytes):
+                    f = self._rotate(f, day)
+                day = today
+
+                if lines:
+                    f.write("".join(lines))
+                    self.written += len(lines)
+                    dirty = True
+                if dirty and (stop or time.monotonic() - last_sync >= self.fsync_interval):
+                    f.flush()
+                    os.fsync(f.fileno())
+                    last_sync = time.monotonic()
+                    dirty = False
+        except Exception as e:
+            logger.error(f"❌ Interaction log writer stopped: {e}")
+        finally:
+            f.close()
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "rotations": self.rotations, "pending": self.queue.qsize()}
+
+interaction_log = JsonlWriter(LOG_FILE)
+atexit.register(interaction_log.close)
+
 def log_interaction(user, user_msg, bot_response):
-    """Log user-bot interactions to JSONL file."""
+    """Log user-bot interactions to JSONL file (written by a background thread)."""
     entry = {
         "timestamp": datetime.now().isoformat(),
         "user": str(user),
         "user_message": user_msg,
         "bot_response": bot_response
     }
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry) + "\n")
+    with tracing.span("log.jsonl"):
+        interaction_log.write(entry)
 
 def chunk_message(message, limit=2000):
     """Split long messages into chunks under the Discord character limit."""